@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from . import cli
 from . import controllers
 from . import models
 from . import wizard
+
+
+def _company_connect_post_init(env):
+    env['project.task.type']._init_timer_actions()
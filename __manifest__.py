@@ -4,7 +4,7 @@
 
 {
     'name': 'CompanyConnect',
-    'version': '1.0',
+    'version': '1.1',
     'category': 'Human Resources/Attendances',
     'sequence': 240,
     'summary': 'Track employee attendance',
@@ -24,14 +24,17 @@ actions(Check in/Check out) performed by them.
         'security/ir.model.access.csv',
         'data/mail_activity_type_data.xml',
         'data/todo_template.xml',
+        'data/hr_attendance_cron.xml',
         'views/attendance_views.xml',
         'views/todo_views.xml',
+        'views/attendance_wizards_views.xml',
         'views/company_connect_menus.xml',
         'views/todo_wizards_views.xml',
         'views/company_connect_templates.xml'
     ],
     'installable': True,
     'application': True,
+    'post_init_hook': '_company_connect_post_init',
     'assets': {
         'web.assets_backend': [
             'company_connect/static/src/**/*',
@@ -57,10 +60,8 @@ actions(Check in/Check out) performed by them.
             # Front-end libraries
             ('include', 'web._assets_helpers'),
             ('include', 'web._assets_frontend_helpers'),
-            'web/static/lib/jquery/jquery.js',
             'web/static/src/scss/pre_variables.scss',
             'web/static/lib/bootstrap/scss/_variables.scss',
-            ('include', 'web._assets_bootstrap_frontend'),
             ('include', 'web._assets_bootstrap_backend'),
             '/web/static/lib/odoo_ui_icons/*',
             '/web/static/lib/bootstrap/scss/_functions.scss',
@@ -80,29 +81,45 @@ actions(Check in/Check out) performed by them.
             'company_connect/static/src/components/manual_selection/**/*',
             'company_connect/static/src/components/greetings/**/*',
             'company_connect/static/src/components/pin_code/**/*',
-            'company_connect/static/src/components/kiosk_barcode/**/*',
             'company_connect/static/src/components/check_in_out/**/*',
             "web/static/src/views/fields/formatters.js",
+            "web/static/src/webclient/webclient_layout.scss",
 
-            # Barcode reader utils
+            # Hardware (keyboard wedge) barcode scanners
+            "barcodes/static/src/barcode_service.js",
+        ],
+        # Styles of the manual selection, only loaded when the kiosk mode allows it
+        'company_connect.assets_public_attendance_manual': [
+            ('include', 'web._assets_helpers'),
+            ('include', 'web._assets_frontend_helpers'),
+            'web/static/src/scss/pre_variables.scss',
+            'web/static/lib/bootstrap/scss/_variables.scss',
+            '/web/static/lib/bootstrap/scss/_functions.scss',
+            '/web/static/lib/bootstrap/scss/_mixins.scss',
+            "web/static/src/views/kanban/kanban_controller.scss",
+            "web/static/src/search/search_panel/search_panel.scss",
+            "web/static/src/search/control_panel/control_panel.scss",
+        ],
+        # Camera barcode reader, lazy loaded by the kiosk when the barcode source is a camera
+        'company_connect.assets_public_attendance_barcode': [
+            ('include', 'web._assets_helpers'),
+            ('include', 'web._assets_frontend_helpers'),
+            'web/static/src/scss/pre_variables.scss',
+            'web/static/lib/bootstrap/scss/_variables.scss',
+            '/web/static/lib/bootstrap/scss/_functions.scss',
+            '/web/static/lib/bootstrap/scss/_mixins.scss',
             "web/static/src/webclient/barcode/barcode_scanner.js",
             "web/static/src/webclient/barcode/barcode_scanner.xml",
             "web/static/src/webclient/barcode/barcode_scanner.scss",
             "web/static/src/webclient/barcode/crop_overlay.js",
-            "web/static/src/webclient/webclient_layout.scss",
             "web/static/src/webclient/barcode/crop_overlay.xml",
             "web/static/src/webclient/barcode/crop_overlay.scss",
             "web/static/src/webclient/barcode/ZXingBarcodeDetector.js",
             "barcodes/static/src/components/barcode_scanner.js",
             "barcodes/static/src/components/barcode_scanner.xml",
             "barcodes/static/src/components/barcode_scanner.scss",
-            "barcodes/static/src/barcode_service.js",
-
-            # Kanban view mock
-            "web/static/src/views/kanban/kanban_controller.scss",
-            "web/static/src/search/search_panel/search_panel.scss",
-            "web/static/src/search/control_panel/control_panel.scss",
-        ]
+            'company_connect/static/src/components/kiosk_barcode/**/*',
+        ],
     },
     'license': 'LGPL-3',
 }
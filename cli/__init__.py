@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+# The command line finds the commands by importing the addons, as the server workers do: only
+# their entry points are defined here, their implementation is imported when they are run.
+
+from odoo.cli import Command
+
+
+class AttendanceGenerate(Command):
+    """ Fill a test database with companies, employees and years of realistic attendances """
+    name = 'attendance_generate'
+
+    def run(self, args):
+        from .attendance_generate import AttendanceGenerate
+        return AttendanceGenerate().run(args)
+
+
+class KioskLoadTest(Command):
+    """ Simulate kiosk and systray check in/out traffic against a running server of a test database """
+    name = 'kiosk_load_test'
+
+    def run(self, args):
+        from .kiosk_load_test import KioskLoadTest
+        return KioskLoadTest().run(args)
+
+
+class OvertimeRebuild(Command):
+    """ Rebuild the extra hours of the employees using a pool of worker processes """
+    name = 'overtime_rebuild'
+
+    def run(self, args):
+        from .overtime import OvertimeRebuild
+        return OvertimeRebuild().run(args)
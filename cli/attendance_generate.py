@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import io
+import logging
+import optparse
+import os
+import random
+import sys
+import time
+
+from datetime import date, datetime, timedelta
+
+import pytz
+
+import odoo
+from odoo.tools import config
+
+from odoo.addons.company_connect.cli.overtime import rebuild_overtime
+from odoo.addons.company_connect.models.utils import MAX_SHIFT_GAP, interval_overlap
+
+_logger = logging.getLogger(__name__)
+
+# Context of the ORM creations: no chatter, no followers, no tracking
+GENERATOR_CONTEXT = {
+    'tracking_disable': True,
+    'mail_create_nolog': True,
+    'mail_create_nosubscribe': True,
+    'mail_notrack': True,
+    'no_reset_password': True,
+}
+
+ATTENDANCE_COLUMNS = [
+    'employee_id', 'check_in', 'check_out', 'check_in_date', 'check_out_date', 'worked_hours', 'overtime_hours',
+    'in_mode', 'out_mode', 'create_uid', 'create_date', 'write_uid', 'write_date',
+]
+
+DEPARTMENT_NAMES = [
+    'Production', 'Logistics', 'Sales', 'Research & Development', 'Customer Support',
+    'Finance', 'Human Resources', 'Quality', 'Maintenance', 'IT',
+]
+FIRST_NAMES = [
+    'Ana', 'Carlos', 'Lucia', 'Javier', 'Marta', 'David', 'Elena', 'Pablo', 'Laura', 'Sergio',
+    'Paula', 'Daniel', 'Sara', 'Alejandro', 'Irene', 'Manuel', 'Clara', 'Jorge', 'Nuria', 'Raul',
+]
+LAST_NAMES = [
+    'Garcia', 'Martinez', 'Lopez', 'Sanchez', 'Perez', 'Gomez', 'Martin', 'Jimenez', 'Ruiz', 'Hernandez',
+    'Diaz', 'Moreno', 'Alvarez', 'Romero', 'Navarro', 'Torres', 'Dominguez', 'Vazquez', 'Ramos', 'Gil',
+]
+# (month, day) of the public holidays, as global leaves of every company
+PUBLIC_HOLIDAYS = [(1, 1), (1, 6), (5, 1), (8, 15), (10, 12), (11, 1), (12, 6), (12, 8), (12, 25)]
+
+# name, weight among the employees, hours per day, (dayofweek, hour_from, hour_to, day_period) lines
+CALENDARS = [
+    ('Standard 40 Hours', 60, 8, [
+        (day, hour_from, hour_to, period)
+        for day in '01234'
+        for hour_from, hour_to, period in ((8, 12, 'morning'), (12, 13, 'lunch'), (13, 17, 'afternoon'))
+    ]),
+    ('Part Time 20 Hours', 15, 4, [(day, 9, 13, 'morning') for day in '01234']),
+    ('Compressed 4x9.5 Hours', 15, 9.5, [
+        (day, hour_from, hour_to, period)
+        for day in '0123'
+        for hour_from, hour_to, period in ((7, 12, 'morning'), (12, 12.5, 'lunch'), (12.5, 17, 'afternoon'))
+    ]),
+    # From Sunday to Thursday night, split at midnight
+    ('Night Shift 40 Hours', 10, 8,
+        [(day, 22, 24, 'afternoon') for day in '60123'] + [(day, 0, 6, 'morning') for day in '01234']),
+]
+
+
+class AttendanceGenerate:
+    """ Implementation of the attendance_generate command, see cli/__init__.py """
+
+    def run(self, args):
+        parser = config.parser
+        group = optparse.OptionGroup(parser, "Attendance data generator",
+            "Create companies with departments, calendars, leaves, badge employees and years of attendances "
+            "in the database specified by the `-d` argument, then build their extra hours. The same options "
+            "and seed generate the same data on a fresh database. Only use it on a test database.")
+        group.add_option("--companies", type="int", dest="companies", default=1,
+            help="Number of companies (default: %default)")
+        group.add_option("--employees", type="int", dest="employees", default=100,
+            help="Number of employees per company (default: %default)")
+        group.add_option("--departments", type="int", dest="departments", default=5,
+            help="Number of departments per company (default: %default)")
+        group.add_option("--years", type="float", dest="years", default=1,
+            help="Years of attendances before --until (default: %default)")
+        group.add_option("--until", dest="until", default=None,
+            help="Day (YYYY-MM-DD, excluded) the attendances stop at (default: today)")
+        group.add_option("--tz", dest="tz", default='Europe/Madrid',
+            help="Timezone of the calendars and employees (default: %default)")
+        group.add_option("--vacation-days", type="int", dest="vacation_days", default=22,
+            help="Personal leave days per employee and year (default: %default)")
+        group.add_option("--absence-rate", type="float", dest="absence_rate", default=0.02,
+            help="Share of the planned shifts not worked nor on leave (default: %default)")
+        group.add_option("--overtime-rate", type="float", dest="overtime_rate", default=0.1,
+            help="Share of the shifts worked longer than planned (default: %default)")
+        group.add_option("--extra-day-rate", type="float", dest="extra_day_rate", default=0.02,
+            help="Share of the days off worked anyway (default: %default)")
+        group.add_option("--forgotten-rate", type="float", dest="forgotten_rate", default=0.005,
+            help="Share of the shifts whose check out was forgotten and entered hours later (default: %default)")
+        group.add_option("--seed", type="int", dest="seed", default=0,
+            help="Seed of the generator (default: %default)")
+        group.add_option("--processes", type="int", dest="processes", default=os.cpu_count(),
+            help="Number of worker processes of the extra hours build (default: number of cores)")
+        group.add_option("--chunk-size", type="int", dest="chunk_size", default=50,
+            help="Number of employees generated or rebuilt in one transaction (default: 50)")
+        parser.add_option_group(group)
+        opt = config.parse_config(args)
+
+        dbname = config['db_name']
+        if not dbname:
+            _logger.error('Attendance data generator needs a database name. Use "-d" argument')
+            sys.exit(1)
+        if opt.processes < 1 or opt.chunk_size < 1:
+            _logger.error('--processes and --chunk-size must be positive')
+            sys.exit(1)
+        until = date.fromisoformat(opt.until) if opt.until else date.today()
+        date_from = until - timedelta(days=round(opt.years * 365))
+
+        start = time.time()
+        registry = odoo.registry(dbname)
+        with registry.cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, GENERATOR_CONTEXT)
+            employees = env['hr.employee']
+            # Random stream of each employee, keyed on its position rather than on database ids
+            streams = {}
+            for company_index in range(opt.companies):
+                company_employees = self._generate_company(env, opt, company_index, date_from, until)
+                streams.update({
+                    employee.id: '%s-attendances-%s-%s' % (opt.seed, company_index, position)
+                    for position, employee in enumerate(company_employees)
+                })
+                employees |= company_employees
+                cr.commit()
+            _logger.info("%s employees created in %.0fs", len(employees), time.time() - start)
+
+            rows = 0
+            employee_ids = employees.ids
+            for i in range(0, len(employee_ids), opt.chunk_size):
+                chunk = employees.browse(employee_ids[i:i + opt.chunk_size])
+                rows += self._generate_attendances(env, opt, chunk, streams, date_from, until)
+                cr.commit()
+                env.invalidate_all()
+                _logger.info("Attendances generated for %s/%s employees, %s rows, %.0fs elapsed",
+                             min(i + opt.chunk_size, len(employee_ids)), len(employee_ids), rows, time.time() - start)
+
+            # The attendances were inserted behind the ORM's back
+            for fname in ('last_attendance_id', 'last_check_in', 'last_check_out'):
+                env.add_to_compute(employees._fields[fname], employees)
+            env.flush_all()
+            cr.commit()
+
+        if rebuild_overtime(dbname, employee_ids, opt.processes, opt.chunk_size):
+            sys.exit(1)
+        _logger.info("%s attendances of %s employees generated in %.0fs", rows, len(employee_ids), time.time() - start)
+
+    def _generate_company(self, env, opt, company_index, date_from, until):
+        """ Create one company with its calendars, departments, public holidays, employees and their
+            personal leaves. Returns the employees.
+        """
+        rng = random.Random('%s-company-%s' % (opt.seed, company_index))
+        company = env['res.company'].create({
+            'name': 'Generated Company %s-%s' % (opt.seed, company_index + 1),
+            'hr_attendance_overtime': True,
+            'overtime_start_date': date_from,
+            'attendance_kiosk_mode': 'barcode_manual',
+        })
+        calendars = env['resource.calendar'].create([{
+            'name': name,
+            'company_id': company.id,
+            'tz': opt.tz,
+            'hours_per_day': hours_per_day,
+            'attendance_ids': [(5, 0, 0)] + [(0, 0, {
+                'name': '%s %s-%s' % (dayofweek, hour_from, hour_to),
+                'dayofweek': dayofweek,
+                'hour_from': hour_from,
+                'hour_to': hour_to,
+                'day_period': day_period,
+            }) for dayofweek, hour_from, hour_to, day_period in lines],
+        } for name, _weight, hours_per_day, lines in CALENDARS])
+        company.resource_calendar_id = calendars[0]
+        departments = env['hr.department'].create([{
+            'name': DEPARTMENT_NAMES[i % len(DEPARTMENT_NAMES)] + (' %s' % (i // len(DEPARTMENT_NAMES) + 1) if i >= len(DEPARTMENT_NAMES) else ''),
+            'company_id': company.id,
+        } for i in range(opt.departments)])
+
+        tz = pytz.timezone(opt.tz)
+        env['resource.calendar.leaves'].create([{
+            'name': 'Public Holiday',
+            'company_id': company.id,
+            'calendar_id': False,
+            'date_from': self._to_utc(tz, day),
+            'date_to': self._to_utc(tz, day + timedelta(days=1)) - timedelta(seconds=1),
+        } for year in range(date_from.year, until.year + 1)
+            for month, day_of_month in PUBLIC_HOLIDAYS
+            for day in [date(year, month, day_of_month)]])
+
+        employees = env['hr.employee']
+        weights = [weight for _name, weight, _hours, _lines in CALENDARS]
+        for batch in range(0, opt.employees, 500):
+            batch_employees = env['hr.employee'].create([{
+                'name': '%s %s %s' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(LAST_NAMES)),
+                'company_id': company.id,
+                'department_id': rng.choice(departments).id if departments else False,
+                'resource_calendar_id': rng.choices(calendars, weights)[0].id,
+                'tz': opt.tz,
+                'barcode': '%04d%07d' % (company.id, i + 1),
+                'pin': '%04d' % rng.randrange(10000),
+            } for i in range(batch, min(batch + 500, opt.employees))])
+            # Personal leaves: the vacation days of each year, in three blocks
+            blocks = [opt.vacation_days // 2, opt.vacation_days // 4]
+            blocks.append(opt.vacation_days - sum(blocks))
+            env['resource.calendar.leaves'].create([{
+                'name': 'Vacation',
+                'company_id': company.id,
+                'calendar_id': employee.resource_calendar_id.id,
+                'resource_id': employee.resource_id.id,
+                'date_from': self._to_utc(tz, first_day),
+                'date_to': self._to_utc(tz, first_day + timedelta(days=length)) - timedelta(seconds=1),
+            } for employee in batch_employees
+                for year in range(date_from.year, until.year + 1)
+                for length in blocks if length
+                for first_day in [date(year, 1, 1) + timedelta(days=rng.randrange(365 - length))]])
+            employees |= batch_employees
+        return employees
+
+    def _generate_attendances(self, env, opt, employees, streams, date_from, until):
+        """ Insert the attendances of the employees from date_from to until with COPY, bypassing the
+            overtime computation. Returns the number of attendances inserted.
+        """
+        days = [date_from + timedelta(days=i) for i in range((until - date_from).days)]
+        planned_days = env['hr.attendance.planned.day']._get_planned_days({employee: days for employee in employees})
+        now = int(time.time())
+        now_utc = datetime.utcnow().replace(microsecond=0)
+        buffer = io.StringIO()
+        rows = 0
+        for employee in employees:
+            rng = random.Random(streams[employee.id])
+            tz = pytz.timezone(employee.tz or opt.tz)
+            planned = {day: planned_days[employee.id, day] for day in days}
+
+            # Shifts: the planned work intervals glued over lunch breaks and midnight, plus a few days off worked
+            shifts = []
+            for start, stop in sorted(interval for work, _lunches in planned.values() for interval in work):
+                if shifts and start - shifts[-1][1] <= MAX_SHIFT_GAP:
+                    shifts[-1][1] = max(shifts[-1][1], stop)
+                else:
+                    shifts.append([start, stop])
+            for day in days:
+                if not planned[day][0] and rng.random() < opt.extra_day_rate:
+                    start = tz.localize(datetime.combine(day, datetime.min.time()) + timedelta(hours=rng.choice([8, 9, 10]))).timestamp()
+                    shifts.append([start, start + rng.uniform(2, 6) * 3600])
+            shifts.sort()
+
+            attendances = []
+            for start, stop in shifts:
+                if rng.random() < opt.absence_rate:
+                    continue
+                check_in = start + rng.gauss(-300, 420)
+                check_out = stop + rng.gauss(300, 600)
+                if rng.random() < opt.overtime_rate:
+                    check_out += rng.uniform(0.5, 3) * 3600
+                if rng.random() < opt.forgotten_rate:
+                    check_out = check_in + rng.uniform(14, 20) * 3600
+                attendances.append([int(check_in), int(check_out)])
+            # No overlap, nothing in the future, at least one minute worked
+            for attendance, next_attendance in zip(attendances, attendances[1:] + [[now, now]]):
+                attendance[1] = min(attendance[1], next_attendance[0] - 60)
+            attendances = [attendance for attendance in attendances if attendance[1] - attendance[0] >= 60]
+
+            for check_in, check_out in attendances:
+                first_day = datetime.fromtimestamp(check_in, tz).date()
+                last_day = datetime.fromtimestamp(check_out, tz).date()
+                lunches = [lunch for i in range((last_day - first_day).days + 1)
+                           for lunch in planned.get(first_day + timedelta(days=i), ((), ()))[1]]
+                worked_hours = (check_out - check_in - interval_overlap(check_in, check_out, lunches)) / 3600.0
+                mode = 'kiosk' if rng.random() < 0.8 else 'systray'
+                buffer.write("%s\t%s\t%s\t%s\t%s\t%s\t0.0\t%s\t%s\t%s\t%s\t%s\t%s\n" % (
+                    employee.id,
+                    datetime.utcfromtimestamp(check_in), datetime.utcfromtimestamp(check_out),
+                    first_day, last_day, worked_hours,
+                    mode, mode, env.uid, now_utc, env.uid, now_utc,
+                ))
+                rows += 1
+
+        env['hr.attendance'].flush_model()
+        buffer.seek(0)
+        env.cr.copy_expert("COPY hr_attendance (%s) FROM STDIN" % ", ".join(ATTENDANCE_COLUMNS), buffer)
+        return rows
+
+    def _to_utc(self, tz, day):
+        """ Naive UTC datetime of the local midnight starting the day """
+        return tz.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.utc).replace(tzinfo=None)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import http.client
+import json
+import logging
+import optparse
+import random
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import odoo
+from odoo.service import security
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# HTTP statuses of an overloaded server (no worker available, proxy timeout...) on which requests are retried
+RETRY_HTTP_STATUSES = (429, 502, 503, 504)
+
+
+class RouteStats:
+    """ Thread-safe latencies and outcomes of the requests sent to one route """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.retries = 0
+
+    def add(self, latency, error, retries):
+        with self.lock:
+            self.latencies.append(latency)
+            self.errors += error
+            self.retries += retries
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+        count = len(latencies)
+        return {
+            'requests': count,
+            'throughput': count / duration,
+            'error_rate': self.errors / count,
+            'retry_rate': self.retries / count,
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': latencies[-1] * 1000,
+        }
+
+
+class JsonRpcClient:
+    """ Keep-alive JSON-RPC client of one simulated kiosk or systray user """
+
+    def __init__(self, url, stats, session_id=None, timeout=30, max_retries=2):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.stats = stats
+        self.headers = {'Content-Type': 'application/json'}
+        if session_id:
+            self.headers['Cookie'] = 'session_id=%s' % session_id
+        self.max_retries = max_retries
+
+    def call(self, route, params, scheduled):
+        """ Call the route and record its latency, measured from the time the request was scheduled
+            at (not sent at) so that a saturated server can't hide its queueing delay.
+        """
+        body = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'params': params})
+        retries, error, result = 0, True, None
+        while True:
+            try:
+                self.connection.request('POST', route, body, self.headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                if response.status in RETRY_HTTP_STATUSES and retries < self.max_retries:
+                    retries += 1
+                    continue
+                if response.status == 200:
+                    payload = json.loads(data)
+                    error = 'error' in payload
+                    result = payload.get('result')
+                    if error:
+                        _logger.debug("%s: %s", route, payload['error'].get('data', {}).get('message'))
+                break
+            except (OSError, http.client.HTTPException):
+                self.connection.close()
+                if retries >= self.max_retries:
+                    break
+                retries += 1
+        self.stats[route].add(time.monotonic() - scheduled, error, retries)
+        return result
+
+    def close(self):
+        self.connection.close()
+
+
+class KioskLoadTest:
+    """ Implementation of the kiosk_load_test command, see cli/__init__.py """
+
+    def run(self, args):
+        parser = config.parser
+        group = optparse.OptionGroup(parser, "Kiosk load test",
+            "Check employees in and out of the database specified by the `-d` argument through the kiosk "
+            "and systray routes of the server at --url, then report throughput and latencies per route. "
+            "Attendances are really created: only use it on a test database.")
+        group.add_option("--url", dest="url", default="http://localhost:8069",
+            help="Base URL of the server under test (default: %default)")
+        group.add_option("--kiosks", type="int", dest="kiosks", default=10,
+            help="Number of simulated kiosks (default: %default)")
+        group.add_option("--kiosk-rate", type="float", dest="kiosk_rate", default=1.0,
+            help="Swipes per second of each kiosk (default: %default)")
+        group.add_option("--manual-ratio", type="float", dest="manual_ratio", default=0.2,
+            help="Share of kiosk swipes done by manual selection instead of badge (default: %default)")
+        group.add_option("--systray-users", type="int", dest="systray_users", default=10,
+            help="Number of simulated systray users (default: %default)")
+        group.add_option("--systray-rate", type="float", dest="systray_rate", default=0.1,
+            help="Check in/out per second of each systray user (default: %default)")
+        group.add_option("--duration", type="float", dest="duration", default=60,
+            help="Duration of the test in seconds (default: %default)")
+        group.add_option("--max-retries", type="int", dest="max_retries", default=2,
+            help="Retries of a request on connection errors and overload statuses (default: %default)")
+        group.add_option("--seed", type="int", dest="seed", default=0,
+            help="Seed of the traffic generator, for repeatable runs (default: %default)")
+        parser.add_option_group(group)
+        opt = config.parse_config(args)
+
+        dbname = config['db_name']
+        if not dbname:
+            _logger.error('Kiosk load test needs a database name. Use "-d" argument')
+            sys.exit(1)
+
+        kiosks, systray_session_ids = self._prepare(dbname, opt)
+        if not kiosks and not systray_session_ids:
+            _logger.error("No kiosk employee nor systray user to simulate in database %s", dbname)
+            sys.exit(1)
+        stats = defaultdict(RouteStats)
+        stop = time.monotonic() + opt.duration
+        rng = random.Random(opt.seed)
+        threads = [
+            threading.Thread(target=self._kiosk_loop, args=(opt, stats, stop, random.Random(rng.random()), kiosks))
+            for _i in range(opt.kiosks if kiosks else 0)
+        ] + [
+            threading.Thread(target=self._systray_loop, args=(opt, stats, stop, random.Random(rng.random()), session_id))
+            for session_id in systray_session_ids
+        ]
+        _logger.info("Simulating %s kiosks and %s systray users against %s for %ss",
+                     opt.kiosks if kiosks else 0, len(systray_session_ids), opt.url, opt.duration)
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._report(stats, time.monotonic() - start)
+
+    def _prepare(self, dbname, opt):
+        """ Returns the kiosk swipes to pick from, as (token, employee_id, barcode, pin) tuples, and the
+            session ids of the simulated systray users.
+        """
+        registry = odoo.registry(dbname)
+        with registry.cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            employees = env['hr.employee'].search([('company_id.attendance_kiosk_key', '!=', False)])
+            kiosks = [
+                (employee.company_id.attendance_kiosk_key, employee.id, employee.barcode, employee.pin)
+                for employee in employees
+            ]
+            users = env['res.users'].search([
+                ('employee_id', '!=', False),
+                ('employee_id.company_id.attendance_from_systray', '=', True),
+                ('share', '=', False),
+            ], limit=opt.systray_users, order='id')
+            session_ids = []
+            for user in users:
+                # Sessions are created directly in the session store, as the test framework does,
+                # so that no password is needed
+                session = odoo.http.root.session_store.new()
+                session.update(odoo.http.get_default_session(), db=dbname)
+                session.uid = user.id
+                session.login = user.login
+                session.context = dict(user.with_user(user).context_get())
+                session.session_token = security.compute_session_token(session, env(user=user))
+                odoo.http.root.session_store.save(session)
+                session_ids.append(session.sid)
+        return kiosks, session_ids
+
+    def _wait(self, rng, rate, scheduled):
+        """ Poisson arrivals: returns the time of the next request, after sleeping until it """
+        scheduled += rng.expovariate(rate)
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return scheduled
+
+    def _kiosk_loop(self, opt, stats, stop, rng, kiosks):
+        client = JsonRpcClient(opt.url, stats, max_retries=opt.max_retries)
+        scheduled = time.monotonic()
+        try:
+            while True:
+                scheduled = self._wait(rng, opt.kiosk_rate, scheduled)
+                if scheduled >= stop:
+                    break
+                token, employee_id, barcode, pin = rng.choice(kiosks)
+                if barcode and rng.random() >= opt.manual_ratio:
+                    client.call('/company_connect/attendance_barcode_scanned',
+                                {'token': token, 'barcode': barcode}, scheduled)
+                else:
+                    client.call('/company_connect/attendance_employee_data',
+                                {'token': token, 'employee_id': employee_id}, scheduled)
+                    client.call('/company_connect/manual_selection',
+                                {'token': token, 'employee_id': employee_id, 'pin_code': pin or False}, time.monotonic())
+        finally:
+            client.close()
+
+    def _systray_loop(self, opt, stats, stop, rng, session_id):
+        client = JsonRpcClient(opt.url, stats, session_id=session_id, max_retries=opt.max_retries)
+        scheduled = time.monotonic()
+        try:
+            while True:
+                scheduled = self._wait(rng, opt.systray_rate, scheduled)
+                if scheduled >= stop:
+                    break
+                client.call('/company_connect/systray_check_in_out', {}, scheduled)
+        finally:
+            client.close()
+
+    def _report(self, stats, duration):
+        header = "%-48s %8s %9s %7s %7s %8s %8s %8s %8s" % (
+            "route", "requests", "req/s", "errors", "retries", "p50 ms", "p90 ms", "p99 ms", "max ms")
+        lines = [header, "-" * len(header)]
+        for route in sorted(stats):
+            summary = stats[route].summary(duration)
+            lines.append("%-48s %8d %9.2f %6.2f%% %6.2f%% %8.1f %8.1f %8.1f %8.1f" % (
+                route, summary['requests'], summary['throughput'],
+                summary['error_rate'] * 100, summary['retry_rate'] * 100,
+                summary['p50'], summary['p90'], summary['p99'], summary['max']))
+        print("\n".join(lines))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+from functools import partial
+
+import odoo
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+
+def _rebuild_employees(dbname, employee_ids):
+    """ Rebuild the extra hours of a chunk of employees in its own cursor and transaction.
+        Runs in a worker process, returns (employee_ids, error message or None).
+    """
+    registry = odoo.registry(dbname)
+    try:
+        with registry.cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            env['hr.employee'].browse(employee_ids)._rebuild_overtime()
+    except Exception as e:
+        _logger.exception("Extra hours rebuild failed for employees %s", employee_ids)
+        return employee_ids, str(e)
+    return employee_ids, None
+
+
+class OvertimeRebuild:
+    """ Implementation of the overtime_rebuild command, see cli/__init__.py """
+
+    def run(self, args):
+        parser = config.parser
+        group = optparse.OptionGroup(parser, "Extra hours rebuild",
+            "Rebuild the extra hours of the employees of the database specified by the `-d` argument.")
+        group.add_option("--company", action="append", type="int", dest="company_ids", default=[],
+            help="Only rebuild the employees of this company id (can be repeated)")
+        group.add_option("--processes", type="int", dest="processes", default=os.cpu_count(),
+            help="Number of worker processes, each with its own cursor (default: number of cores)")
+        group.add_option("--chunk-size", type="int", dest="chunk_size", default=50,
+            help="Number of employees rebuilt in one transaction (default: 50)")
+        parser.add_option_group(group)
+        opt = config.parse_config(args)
+
+        dbname = config['db_name']
+        if not dbname:
+            _logger.error('Extra hours rebuild needs a database name. Use "-d" argument')
+            sys.exit(1)
+        if opt.processes < 1 or opt.chunk_size < 1:
+            _logger.error('--processes and --chunk-size must be positive')
+            sys.exit(1)
+
+        registry = odoo.registry(dbname)
+        with registry.cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            domain = [('company_id', 'in', opt.company_ids)] if opt.company_ids else []
+            employee_ids = env['hr.employee'].with_context(active_test=False).search(domain, order='id').ids
+
+        if rebuild_overtime(dbname, employee_ids, opt.processes, opt.chunk_size):
+            sys.exit(1)
+
+
+def rebuild_overtime(dbname, employee_ids, processes, chunk_size):
+    """ Rebuild the extra hours of the employees with a pool of worker processes, each chunk of employees
+        in its own cursor and transaction. Returns the ids of the employees whose rebuild failed.
+    """
+    # Fixed partition on the sorted ids: each chunk is rebuilt the same way whatever the number of
+    # processes and the order in which they complete
+    employee_ids = sorted(employee_ids)
+    chunks = [employee_ids[i:i + chunk_size] for i in range(0, len(employee_ids), chunk_size)]
+    _logger.info("Rebuilding extra hours of %s employees in %s chunks with %s processes",
+                 len(employee_ids), len(chunks), processes)
+
+    # Connections must not be shared with the forked workers
+    odoo.sql_db.close_all()
+    done, failed = 0, []
+    start = time.time()
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.imap_unordered(partial(_rebuild_employees, dbname), chunks)
+        for chunk_ids, error in results:
+            done += len(chunk_ids)
+            if error:
+                failed += chunk_ids
+            _logger.info("Extra hours rebuilt for %s/%s employees (%d%%), %s failed, %.0fs elapsed",
+                         done, len(employee_ids), done * 100 // (len(employee_ids) or 1),
+                         len(failed), time.time() - start)
+
+    if failed:
+        _logger.error("Extra hours rebuild failed for employees %s", sorted(failed))
+    return failed
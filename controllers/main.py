@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import http, _
-from odoo.http import request
-from odoo.tools import float_round
-import datetime
+import csv
+import hashlib
+import io
+import json
+import re
+import tempfile
+
+import xlsxwriter
+
+from odoo import api, http, _
+from odoo.addons.company_connect.models.attendance_model import KIOSK_ATTENDANCE_HISTORY_MAX_LIMIT
+from odoo.http import request, content_disposition
+from odoo.tools import file_open
 
 class HrAttendance(http.Controller):
     @staticmethod
@@ -16,26 +25,7 @@ class HrAttendance(http.Controller):
     def _get_employee_info_response(employee):
         response = {}
         if employee:
-            response = {
-                'id': employee.id,
-                'employee_name': employee.name,
-                'employee_avatar': employee.image_1920,
-                'hours_today': float_round(employee.hours_today, precision_digits=2),
-                'total_overtime': float_round(employee.total_overtime, precision_digits=2),
-                'last_attendance_worked_hours': float_round(employee.last_attendance_worked_hours, precision_digits=2),
-                'last_check_in': employee.last_check_in,
-                'attendance_state': employee.attendance_state,
-                'hours_previously_today': float_round(employee.hours_previously_today, precision_digits=2),
-                'kiosk_delay': employee.company_id.attendance_kiosk_delay * 1000,
-                'attendance': {'check_in': employee.last_attendance_id.check_in,
-                               'check_out': employee.last_attendance_id.check_out},
-                'overtime_today': request.env['hr.attendance.overtime'].sudo().search([
-                    ('employee_id', '=', employee.id), ('date', '=', datetime.date.today()),
-                    ('adjustment', '=', False)]).duration or 0,
-                'use_pin': employee.company_id.attendance_kiosk_use_pin,
-                'display_systray': employee.company_id.attendance_from_systray,
-                'display_overtime': employee.company_id.hr_attendance_display_overtime
-            }
+            response = employee._get_attendance_info()
         return response
 
     @staticmethod
@@ -50,6 +40,25 @@ class HrAttendance(http.Controller):
             'mode': mode
         }
 
+    @staticmethod
+    def _get_company_logo_version(company):
+        # logo_web is a small resized copy stored in its column, not an attachment with a checksum
+        return hashlib.sha1(company.sudo().logo_web or b'').hexdigest()
+
+    @staticmethod
+    def _make_kiosk_response(response, kiosk_backend_info):
+        """ Tag the kiosk page with the version of its content, so that the kiosk service worker
+            (and the browser cache) only download it again when the roster, the settings or the
+            asset bundles have changed. The page itself can't be hashed as it holds a fresh csrf token.
+        """
+        response.flatten()
+        assets = sorted(set(re.findall(r'/web/assets/[^"\'\s]+', response.get_data(as_text=True))))
+        version = hashlib.sha1(json.dumps([kiosk_backend_info, assets], sort_keys=True).encode()).hexdigest()
+        response.set_etag(version)
+        response.headers['X-Kiosk-Version'] = version
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request.httprequest)
+
     @http.route('/company_connect/kiosk_mode_menu', auth='user', type='http')
     def kiosk_menu_item_action(self):
         # better use route with company_id suffix
@@ -99,20 +108,34 @@ class HrAttendance(http.Controller):
                                                                                                       "name",
                                                                                                       "total_employee"])]
             request.session.logout(keep_db=True)
-            return request.render(
+            kiosk_backend_info = {
+                'token': token,
+                'company_id': company.id,
+                'company_name': company.name,
+                'company_logo_version': self._get_company_logo_version(company),
+                'employees': employee_list,
+                'departments': departement_list,
+                'kiosk_mode': company.attendance_kiosk_mode,
+                'barcode_source': company.attendance_barcode_source
+            }
+            response = request.render(
                 'company_connect.public_kiosk_mode',
                 {
-                    'kiosk_backend_info': {
-                        'token': token,
-                        'company_id': company.id,
-                        'company_name': company.name,
-                        'employees': employee_list,
-                        'departments': departement_list,
-                        'kiosk_mode': company.attendance_kiosk_mode,
-                        'barcode_source': company.attendance_barcode_source
-                    }
+                    'kiosk_backend_info': kiosk_backend_info
                 }
             )
+            return self._make_kiosk_response(response, kiosk_backend_info)
+
+    @http.route('/company_connect/kiosk_service_worker.js', type='http', auth='public', sitemap=False)
+    def kiosk_service_worker(self):
+        with file_open('company_connect/static/kiosk/service_worker.js', 'rb') as f:
+            body = f.read()
+        return request.make_response(body, [
+            ('Content-Type', 'text/javascript'),
+            # Served from /company_connect/ to control the kiosk pages
+            ('Service-Worker-Allowed', '/company_connect/'),
+            ('Cache-Control', 'no-cache'),
+        ])
 
     @http.route('/company_connect/attendance_employee_data', type="json", auth="public")
     def employee_attendance_data(self, token, employee_id):
@@ -143,6 +166,24 @@ class HrAttendance(http.Controller):
                 return self._get_employee_info_response(employee)
         return {}
 
+    @http.route('/company_connect/attendance_history', type="json", auth="user")
+    def attendance_history(self, employee_ids=None, department_ids=None, date_from=None, date_to=None, cursor=None, limit=80):
+        return request.env['hr.attendance'].get_attendance_history(
+            employee_ids=employee_ids, department_ids=department_ids, date_from=date_from, date_to=date_to,
+            cursor=cursor, limit=limit)
+
+    @http.route('/company_connect/kiosk_attendance_history', type="json", auth="public")
+    def kiosk_attendance_history(self, token, employee_id, pin_code=False, cursor=None, limit=20):
+        # Without PIN codes, the kiosk token alone would give access to the history of every employee
+        company = self._get_company(token)
+        if company and company.attendance_kiosk_use_pin:
+            employee = request.env['hr.employee'].sudo().browse(employee_id)
+            if employee.company_id == company and employee.pin and employee.pin == pin_code:
+                Attendance = request.env['hr.attendance'].sudo()
+                limit = Attendance._check_attendance_history_limit(limit, KIOSK_ATTENDANCE_HISTORY_MAX_LIMIT)
+                return Attendance.get_attendance_history(employee_ids=employee.ids, cursor=cursor, limit=limit)
+        return {}
+
     @http.route('/company_connect/systray_check_in_out', type="json", auth="user")
     def systray_attendance(self, latitude=False, longitude=False):
         employee = request.env.user.employee_id
@@ -150,9 +191,68 @@ class HrAttendance(http.Controller):
                                                   latitude=latitude,
                                                   longitude=longitude)
         employee._attendance_action_change(geo_ip_response)
-        return self._get_employee_info_response(employee)
+        return employee.sudo()._get_systray_attendance_info()
 
     @http.route('/company_connect/attendance_user_data', type="json", auth="user")
     def user_attendance_data(self):
         employee = request.env.user.employee_id
-        return self._get_employee_info_response(employee)
+        return employee.sudo()._get_systray_attendance_info() if employee else {}
+
+    @http.route('/company_connect/payroll_export/<int:export_id>', type='http', auth='user')
+    def payroll_export(self, export_id):
+        if not request.env.user.user_has_groups('company_connect.group_company_connect_hr_attendance_manager'):
+            return request.not_found()
+        export = request.env['hr.attendance.payroll.export'].browse(export_id).exists()
+        if not export:
+            return request.not_found()
+        # The wizard may hold companies the user can't or doesn't currently work in
+        company_ids = (export.company_ids & request.env.companies).ids
+        if not company_ids:
+            return request.not_found()
+        export_args = (export.date_from, export.date_to, company_ids, export._get_department_ids())
+        filename = 'payroll_%s_%s.%s' % (export.date_from, export.date_to, export.file_format)
+        if export.file_format == 'xlsx':
+            return request.make_response(
+                self._payroll_export_xlsx(request.env, *export_args),
+                headers=[('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+                         ('Content-Disposition', content_disposition(filename))])
+        return request.make_response(
+            self._payroll_export_csv(request.env.registry, request.env.uid, request.env.context, *export_args),
+            headers=[('Content-Type', 'text/csv;charset=utf-8'),
+                     ('Content-Disposition', content_disposition(filename))])
+
+    @staticmethod
+    def _payroll_export_csv(registry, uid, context, *export_args):
+        # Streamed after the request returns, hence on its own cursor
+        with registry.cursor() as cr:
+            env = api.Environment(cr, uid, context)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(env['hr.attendance']._get_payroll_export_header())
+            for row in env['hr.attendance']._iter_payroll_export_rows(*export_args):
+                writer.writerow(row)
+                if buffer.tell() > 65536:
+                    yield buffer.getvalue().encode()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue().encode()
+
+    @staticmethod
+    def _payroll_export_xlsx(env, *export_args):
+        # constant_memory flushes every row to disk once written, the file is then streamed
+        output = tempfile.TemporaryFile()
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'in_memory': False})
+        worksheet = workbook.add_worksheet(_('Attendances'))
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+        worksheet.write_row(0, 0, env['hr.attendance']._get_payroll_export_header())
+        for row_index, row in enumerate(env['hr.attendance']._iter_payroll_export_rows(*export_args), start=1):
+            worksheet.write_row(row_index, 0, row[:3])
+            worksheet.write_datetime(row_index, 3, row[3], date_format)
+            for column, value in ((4, row[4]), (5, row[5])):
+                if value:
+                    worksheet.write_datetime(row_index, column, value, datetime_format)
+            worksheet.write_row(row_index, 6, row[6:])
+        workbook.close()
+        output.seek(0)
+        return iter(lambda: output.read(65536), b'')
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools.sql import column_exists
+
+
+def migrate(cr, version):
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    # The stages used to start or stop the timer by their name
+    env['project.task.type']._init_timer_actions()
+
+    # The time spent and the running timer were stored on the to-dos: the time spent becomes one
+    # closed session ending when the timer was last (re)started or the to-do last written, which
+    # keeps the stored total of the closed sessions unchanged, and a running timer a running session
+    if not all(column_exists(cr, 'project_task', column) for column in ('time_spent', 'timer', 'timer_start')):
+        return
+    cr.execute("""
+        INSERT INTO project_task_timer_session (task_id, user_id, start, stop, duration,
+                                                create_uid, create_date, write_uid, write_date)
+             SELECT task.id,
+                    task.user_id,
+                    task.stop - make_interval(secs => task.time_spent * 3600),
+                    task.stop,
+                    task.time_spent,
+                    %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC'
+               FROM (SELECT id,
+                            COALESCE(write_uid, create_uid, %(uid)s) AS user_id,
+                            time_spent::float AS time_spent,
+                            COALESCE(CASE WHEN timer THEN timer_start END, write_date, now() AT TIME ZONE 'UTC') AS stop
+                       FROM project_task
+                      WHERE time_spent > 0) task
+              WHERE NOT EXISTS (SELECT 1 FROM project_task_timer_session seeded WHERE seeded.task_id = task.id)
+    """, {'uid': SUPERUSER_ID})
+    cr.execute("""
+        INSERT INTO project_task_timer_session (task_id, user_id, start, stop, duration,
+                                                create_uid, create_date, write_uid, write_date)
+             SELECT task.id,
+                    COALESCE(task.write_uid, task.create_uid, %(uid)s),
+                    task.timer_start,
+                    NULL,
+                    0.0,
+                    %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC'
+               FROM project_task task
+              WHERE task.timer
+                AND task.timer_start IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM project_task_timer_session seeded
+                                 WHERE seeded.task_id = task.id AND seeded.stop IS NULL)
+    """, {'uid': SUPERUSER_ID})
@@ -1,24 +1,59 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import json
+import logging
+import psycopg2
 import pytz
+import re
 import uuid
 
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from operator import itemgetter
-from pytz import timezone
 
-from odoo import models, fields, api, exceptions, _
-from odoo.addons.resource.models.utils import Intervals
-from odoo.tools import format_datetime, float_round
+from odoo import models, fields, api, exceptions, _, SUPERUSER_ID
+from odoo.addons.company_connect.models.shared_cache import SharedCache
+from odoo.addons.company_connect.models.utils import compute_overtime, interval_overlap, planned_shift_end
+from odoo.tools import format_datetime, float_round, SQL
+from odoo.tools.sql import column_exists, create_column, index_exists, table_exists
 from odoo.osv.expression import AND, OR
 from odoo.tools.float_utils import float_is_zero
 from odoo.exceptions import AccessError
 from odoo.tools import format_duration
 from werkzeug.urls import url_join
 
+_logger = logging.getLogger(__name__)
+
+# Partial unique index allowing a single "open" attendance (without check_out) per employee
+OPEN_ATTENDANCE_INDEX = 'hr_attendance_unique_open_per_employee'
+
+# Rows fetched at once from the server-side cursor of the payroll export
+PAYROLL_EXPORT_BATCH_SIZE = 2000
+
+# First key of the transaction level advisory locks serializing the check in/out of an employee,
+# the second key being the employee id
+ATTENDANCE_LOCK_NAMESPACE = 6363
+
+# Attempts of each batch of the extra hours updates queued by the check in/out
+OVERTIME_UPDATE_TRIES = 5
+
+# Queued days of extra hours updated per transaction
+OVERTIME_UPDATE_BATCH_SIZE = 500
+
+# Days of planned schedule kept, older days are planned again when needed
+PLANNED_DAYS_RETENTION = 400
+
+# Maximum page size of the attendance history API, and of its public kiosk route
+ATTENDANCE_HISTORY_MAX_LIMIT = 500
+KIOSK_ATTENDANCE_HISTORY_MAX_LIMIT = 50
+
+# Presence snapshots per company: (checked_in_ids, working_now_ids)
+PRESENCE_SNAPSHOT_TTL = 60
+presence_snapshots = SharedCache('presence_snapshot', PRESENCE_SNAPSHOT_TTL)
+
+
 def get_google_maps_url(latitude, longitude):
     return "https://maps.google.com?q=%s,%s" % (latitude, longitude)
 
@@ -37,6 +72,10 @@ class HrAttendance(models.Model):
         readonly=True)
     check_in = fields.Datetime(string="Check In", default=fields.Datetime.now, required=True, tracking=True)
     check_out = fields.Datetime(string="Check Out", tracking=True)
+    check_in_date = fields.Date(string="Check In Day", compute='_compute_local_dates', store=True, index=True,
+        help="Day of the check in in the timezone of the employee")
+    check_out_date = fields.Date(string="Check Out Day", compute='_compute_local_dates', store=True, index=True,
+        help="Day of the check out in the timezone of the employee")
     worked_hours = fields.Float(string='Worked Hours', compute='_compute_worked_hours', store=True, readonly=True)
     color = fields.Integer(compute='_compute_color')
     overtime_hours = fields.Float(string="Over Time", compute='_compute_overtime_hours', store=True)
@@ -63,6 +102,92 @@ class HrAttendance(models.Model):
                                            ('manual', "Manual")],
                                 readonly=True,
                                 default='manual')
+    auto_checked_out = fields.Boolean(string="Automatic Check Out", copy=False,
+        help="Closed automatically after a forgotten check out, to be reviewed.\n"
+             "Unset when the check out is corrected.")
+
+    def _auto_init(self):
+        # Filled at once in SQL, with the timezone of _get_tz, rather than computed record by record
+        # on databases that already have attendances
+        if table_exists(self.env.cr, self._table) and not column_exists(self.env.cr, self._table, 'check_in_date'):
+            create_column(self.env.cr, self._table, 'check_in_date', 'date')
+            create_column(self.env.cr, self._table, 'check_out_date', 'date')
+            self._update_local_dates()
+        return super()._auto_init()
+
+    @api.model
+    def _update_local_dates(self, employee_ids=None):
+        """ Sets the local days of the check ins/outs in SQL, with the timezone of _get_tz: for all the
+            attendances when the columns are added, then for those of the given employees when their
+            timezone may have changed, in which case the extra hours of the days the attendances moved
+            from or to are recomputed.
+        """
+        if employee_ids is not None and not employee_ids:
+            return
+        params = {}
+        where = returning = ""
+        if employee_ids is not None:
+            self.env['hr.employee'].flush_model(['resource_id', 'resource_calendar_id', 'company_id'])
+            self.env['resource.resource'].flush_model(['tz'])
+            self.env['resource.calendar'].flush_model(['tz'])
+            self.env['res.company'].flush_model(['resource_calendar_id'])
+            self.flush_model(['employee_id', 'check_in', 'check_out', 'check_in_date', 'check_out_date'])
+            where = "WHERE old.employee_id = ANY(%(employee_ids)s)"
+            returning = "RETURNING att.employee_id, local.old_check_in_date, local.old_check_out_date, " \
+                        "att.check_in_date, att.check_out_date"
+            params['employee_ids'] = list(employee_ids)
+        self.env.cr.execute("""
+            UPDATE hr_attendance att
+               SET check_in_date = local.check_in_date,
+                   check_out_date = local.check_out_date
+              FROM (
+                    SELECT old.id,
+                           old.check_in_date AS old_check_in_date,
+                           old.check_out_date AS old_check_out_date,
+                           (old.check_in AT TIME ZONE 'UTC' AT TIME ZONE emp.tz)::date AS check_in_date,
+                           (old.check_out AT TIME ZONE 'UTC' AT TIME ZONE emp.tz)::date AS check_out_date
+                      FROM hr_attendance old
+                      JOIN (
+                            SELECT emp.id,
+                                   COALESCE(res.tz, calendar.tz, company_calendar.tz, 'UTC') AS tz
+                              FROM hr_employee emp
+                              JOIN resource_resource res ON res.id = emp.resource_id
+                              JOIN res_company company ON company.id = emp.company_id
+                         LEFT JOIN resource_calendar calendar ON calendar.id = emp.resource_calendar_id
+                         LEFT JOIN resource_calendar company_calendar ON company_calendar.id = company.resource_calendar_id
+                           ) emp ON emp.id = old.employee_id
+                    %s
+                   ) local
+             WHERE local.id = att.id
+               AND (local.check_in_date, local.check_out_date)
+                   IS DISTINCT FROM (local.old_check_in_date, local.old_check_out_date)
+            %s
+        """ % (where, returning), params)
+        if employee_ids is None:
+            return
+        moved_days = defaultdict(set)
+        for employee_id, *days in self.env.cr.fetchall():
+            moved_days[employee_id].update(day for day in days if day)
+        if not moved_days:
+            return
+        self.invalidate_model(['check_in_date', 'check_out_date'])
+        employee_attendance_dates = {}
+        for employee in self.env['hr.employee'].sudo().browse(moved_days):
+            company = employee.company_id
+            if company.hr_attendance_overtime:
+                employee_attendance_dates[employee] = {day for day in moved_days[employee.id]
+                                                       if not company.overtime_start_date or day >= company.overtime_start_date}
+        self.sudo()._update_overtime(employee_attendance_dates)
+
+    # Timezone changes are applied by _update_local_dates, in SQL
+    @api.depends('check_in', 'check_out', 'employee_id')
+    def _compute_local_dates(self):
+        for attendance in self:
+            employee = attendance.employee_id
+            attendance.check_in_date = self._get_day_start_and_day(employee, attendance.check_in)[1] \
+                if employee and attendance.check_in else False
+            attendance.check_out_date = self._get_day_start_and_day(employee, attendance.check_out)[1] \
+                if employee and attendance.check_out else False
 
     def _compute_color(self):
         for attendance in self:
@@ -75,7 +200,7 @@ class HrAttendance(models.Model):
     def _compute_overtime_hours(self):
         att_progress_values = dict()
         if self.employee_id:
-            self.env['hr.attendance'].flush_model(['worked_hours'])
+            self.env['hr.attendance'].flush_model(['worked_hours', 'check_in_date', 'check_out_date'])
             self.env['hr.attendance.overtime'].flush_model(['duration'])
             self.env.cr.execute('''
                 SELECT att.id as att_id,
@@ -86,8 +211,8 @@ class HrAttendance(models.Model):
                        att.check_in as ad
                   FROM hr_attendance att
              INNER JOIN hr_attendance_overtime ot
-                    ON date_trunc('day',att.check_in) = date_trunc('day', ot.date)
-                    AND date_trunc('day',att.check_out) = date_trunc('day', ot.date)
+                    ON att.check_in_date = ot.date
+                    AND att.check_out_date = ot.date
                     AND att.employee_id IN %s
                     AND att.employee_id = ot.employee_id
                     ORDER BY att.check_in DESC
@@ -139,18 +264,22 @@ class HrAttendance(models.Model):
 
     @api.depends('check_in', 'check_out')
     def _compute_worked_hours(self):
+        closed_attendances = self.filtered(lambda a: a.check_out and a.check_in and a.employee_id)
+        # Lunch breaks of the local days spanned by each attendance, read at once from the planned days
+        attendance_days = {}
+        employee_days = defaultdict(set)
+        for attendance in closed_attendances:
+            first_day, last_day = attendance.check_in_date, attendance.check_out_date
+            attendance_days[attendance] = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+            employee_days[attendance.employee_id].update(attendance_days[attendance])
+        planned_days = self.env['hr.attendance.planned.day']._get_planned_days(employee_days)
         for attendance in self:
-            if attendance.check_out and attendance.check_in and attendance.employee_id:
-                calendar = attendance._get_employee_calendar()
-                resource = attendance.employee_id.resource_id
-                tz = timezone(calendar.tz)
-                check_in_tz = attendance.check_in.astimezone(tz)
-                check_out_tz = attendance.check_out.astimezone(tz)
-                lunch_intervals = calendar._attendance_intervals_batch(
-                    check_in_tz, check_out_tz, resource, lunch=True)
-                attendance_intervals = Intervals([(check_in_tz, check_out_tz, attendance)]) - lunch_intervals[resource.id]
-                delta = sum((i[1] - i[0]).total_seconds() for i in attendance_intervals)
-                attendance.worked_hours = delta / 3600.0
+            if attendance in attendance_days:
+                check_in = pytz.utc.localize(attendance.check_in).timestamp()
+                check_out = pytz.utc.localize(attendance.check_out).timestamp()
+                lunches = [lunch for day in attendance_days[attendance]
+                           for lunch in planned_days[attendance.employee_id.id, day][1]]
+                attendance.worked_hours = (check_out - check_in - interval_overlap(check_in, check_out, lunches)) / 3600.0
             else:
                 attendance.worked_hours = False
 
@@ -166,44 +295,93 @@ class HrAttendance(models.Model):
     def _check_validity(self):
         """ Verifies the validity of the attendance record compared to the others from the same employee.
             For the same employee we must have :
-                * maximum 1 "open" attendance record (without check_out)
+                * maximum 1 "open" attendance record (without check_out), enforced by the
+                  hr_attendance_unique_open_per_employee index
                 * no overlapping time slices with previous employee records
         """
+        # create and write flush the attendances under _open_attendance_guard
+        self.flush_recordset(['employee_id', 'check_in', 'check_out'])
+        # For each attendance, fetch the latest attendance before its check_in and the latest
+        # attendance before its check_out in a single pass over the (employee_id, check_in) index
+        self.env.cr.execute("""
+            SELECT att.id,
+                   before_in.check_out,
+                   before_in.id,
+                   before_out.id,
+                   before_out.check_in
+              FROM hr_attendance att
+         LEFT JOIN LATERAL (
+                    SELECT prev.id, prev.check_out
+                      FROM hr_attendance prev
+                     WHERE prev.employee_id = att.employee_id
+                       AND prev.check_in <= att.check_in
+                       AND prev.id != att.id
+                  ORDER BY prev.check_in DESC
+                     LIMIT 1
+                   ) before_in ON TRUE
+         LEFT JOIN LATERAL (
+                    SELECT prev.id, prev.check_in
+                      FROM hr_attendance prev
+                     WHERE prev.employee_id = att.employee_id
+                       AND prev.check_in < att.check_out
+                       AND prev.id != att.id
+                  ORDER BY prev.check_in DESC
+                     LIMIT 1
+                   ) before_out ON att.check_out IS NOT NULL
+             WHERE att.id IN %s
+        """, (tuple(self.ids),))
+        neighbours = {row[0]: row[1:] for row in self.env.cr.fetchall()}
         for attendance in self:
-            # we take the latest attendance before our check_in time and check it doesn't overlap with ours
-            last_attendance_before_check_in = self.env['hr.attendance'].search([
-                ('employee_id', '=', attendance.employee_id.id),
-                ('check_in', '<=', attendance.check_in),
-                ('id', '!=', attendance.id),
-            ], order='check_in desc', limit=1)
-            if last_attendance_before_check_in and last_attendance_before_check_in.check_out and last_attendance_before_check_in.check_out > attendance.check_in:
+            before_in_check_out, before_in_id, before_out_id, before_out_check_in = neighbours[attendance.id]
+            # the latest attendance before our check_in time must not overlap with ours
+            if before_in_check_out and before_in_check_out > attendance.check_in:
                 raise exceptions.ValidationError(_("Cannot create new attendance record for %(empl_name)s, the employee was already checked in on %(datetime)s",
                                                    empl_name=attendance.employee_id.name,
                                                    datetime=format_datetime(self.env, attendance.check_in, dt_format=False)))
+            # the latest attendance with check_in time before our check_out time must be the
+            # same as the one before our check_in time, otherwise it overlaps
+            if before_out_id and before_out_id != before_in_id:
+                raise exceptions.ValidationError(_("Cannot create new attendance record for %(empl_name)s, the employee was already checked in on %(datetime)s",
+                                                   empl_name=attendance.employee_id.name,
+                                                   datetime=format_datetime(self.env, before_out_check_in, dt_format=False)))
 
-            if not attendance.check_out:
-                # if our attendance is "open" (no check_out), we verify there is no other "open" attendance
-                no_check_out_attendances = self.env['hr.attendance'].search([
-                    ('employee_id', '=', attendance.employee_id.id),
-                    ('check_out', '=', False),
-                    ('id', '!=', attendance.id),
-                ], order='check_in desc', limit=1)
-                if no_check_out_attendances:
-                    raise exceptions.ValidationError(_("Cannot create new attendance record for %(empl_name)s, the employee hasn't checked out since %(datetime)s",
-                                                       empl_name=attendance.employee_id.name,
-                                                       datetime=format_datetime(self.env, no_check_out_attendances.check_in, dt_format=False)))
+    @contextmanager
+    def _open_attendance_guard(self, open_checks):
+        """ Turns a violation of the single open attendance index by the statements
+            executed in the block into the usual ValidationError.
+
+            :param open_checks: (employee_id, check_in) of the open attendances written in the block
+        """
+        try:
+            with self.env.cr.savepoint(flush=False):
+                yield
+        except psycopg2.errors.UniqueViolation as e:
+            if e.diag.constraint_name != OPEN_ATTENDANCE_INDEX:
+                raise
+            # The detail holds the key of the violating row: "Key (employee_id)=(42) already exists."
+            match = re.search(r'=\((\d+)\)', e.diag.message_detail or '')
+            employee = self.env['hr.employee'].sudo().browse(int(match.group(1))).exists() if match else None
+            if not employee:
+                raise exceptions.ValidationError(_("An employee cannot have more than one attendance without check out.")) from e
+            # In SQL, as a search would flush the rejected values again
+            self.env.cr.execute("""
+                SELECT check_in
+                  FROM hr_attendance
+                 WHERE employee_id = %s AND check_out IS NULL AND id != ALL(%s)
+              ORDER BY check_in DESC
+                 LIMIT 1
+            """, (employee.id, self.ids))
+            row = self.env.cr.fetchone()
+            if row:
+                check_in = row[0]
             else:
-                # we verify that the latest attendance with check_in time before our check_out time
-                # is the same as the one before our check_in time computed before, otherwise it overlaps
-                last_attendance_before_check_out = self.env['hr.attendance'].search([
-                    ('employee_id', '=', attendance.employee_id.id),
-                    ('check_in', '<', attendance.check_out),
-                    ('id', '!=', attendance.id),
-                ], order='check_in desc', limit=1)
-                if last_attendance_before_check_out and last_attendance_before_check_in != last_attendance_before_check_out:
-                    raise exceptions.ValidationError(_("Cannot create new attendance record for %(empl_name)s, the employee was already checked in on %(datetime)s",
-                                                       empl_name=attendance.employee_id.name,
-                                                       datetime=format_datetime(self.env, last_attendance_before_check_out.check_in, dt_format=False)))
+                # The conflicting open attendances are both part of the block
+                check_in = min((fields.Datetime.to_datetime(check_in) or fields.Datetime.now()
+                                for employee_id, check_in in open_checks if employee_id == employee.id),
+                               default=fields.Datetime.now())
+            raise exceptions.ValidationError(_("Cannot create new attendance record for %(empl_name)s, the employee hasn't checked out since %(datetime)s",
+                                               empl_name=employee.name,
+                                               datetime=format_datetime(self.env, check_in, dt_format=False))) from e
 
     @api.model
     def _get_day_start_and_day(self, employee, dt):
@@ -217,16 +395,14 @@ class HrAttendance(models.Model):
         return (start_day_employee_tz.astimezone(pytz.utc).replace(tzinfo=None), start_day_employee_tz.date())
 
     def _get_attendances_dates(self):
-        # Returns a dictionnary {employee_id: set((datetimes, dates))}
+        # Returns a dictionnary {employee: set(local dates)}
         attendances_emp = defaultdict(set)
         for attendance in self.filtered(lambda a: a.employee_id.company_id.hr_attendance_overtime and a.check_in):
-            check_in_day_start = attendance._get_day_start_and_day(attendance.employee_id, attendance.check_in)
-            if check_in_day_start[0] < datetime.combine(attendance.employee_id.company_id.overtime_start_date, datetime.min.time()):
+            if attendance.check_in_date < attendance.employee_id.company_id.overtime_start_date:
                 continue
-            attendances_emp[attendance.employee_id].add(check_in_day_start)
+            attendances_emp[attendance.employee_id].add(attendance.check_in_date)
             if attendance.check_out:
-                check_out_day_start = attendance._get_day_start_and_day(attendance.employee_id, attendance.check_out)
-                attendances_emp[attendance.employee_id].add(check_out_day_start)
+                attendances_emp[attendance.employee_id].add(attendance.check_out_date)
         return attendances_emp
 
     def _get_overtime_leave_domain(self):
@@ -239,129 +415,53 @@ class HrAttendance(models.Model):
         overtime_to_unlink = self.env['hr.attendance.overtime']
         overtime_vals_list = []
         affected_employees = self.env['hr.employee']
-        for emp, attendance_dates in employee_attendance_dates.items():
-            # get_attendances_dates returns the date translated from the local timezone without tzinfo,
-            # and contains all the date which we need to check for overtime
-            attendance_domain = []
-            for attendance_date in attendance_dates:
-                attendance_domain = OR([attendance_domain, [
-                    ('check_in', '>=', attendance_date[0]), ('check_in', '<', attendance_date[0] + timedelta(hours=24)),
-                ]])
-            attendance_domain = AND([[('employee_id', '=', emp.id)], attendance_domain])
 
-            # Attendances per LOCAL day
+        # Planned work (leaves excluded) and lunch intervals of every (employee, local day) of this recompute
+        planned_days = self.env['hr.attendance.planned.day']._get_planned_days({
+            emp: attendance_dates for emp, attendance_dates in employee_attendance_dates.items()
+        })
+
+        for emp, attendance_dates in employee_attendance_dates.items():
+            # Attendances per LOCAL day of their check in, on the (employee_id, check_in_date) index
             attendances_per_day = defaultdict(lambda: self.env['hr.attendance'])
-            all_attendances = self.env['hr.attendance'].search(attendance_domain)
+            all_attendances = self.env['hr.attendance'].search([
+                ('employee_id', '=', emp.id),
+                ('check_in_date', 'in', list(attendance_dates)),
+            ])
             for attendance in all_attendances:
-                check_in_day_start = attendance._get_day_start_and_day(attendance.employee_id, attendance.check_in)
-                attendances_per_day[check_in_day_start[1]] += attendance
-
-            # As _attendance_intervals_batch and _leave_intervals_batch both take localized dates we need to localize those date
-            start = pytz.utc.localize(min(attendance_dates, key=itemgetter(0))[0])
-            stop = pytz.utc.localize(max(attendance_dates, key=itemgetter(0))[0] + timedelta(hours=24))
-
-            # Retrieve expected attendance intervals
-            calendar = emp.resource_calendar_id or emp.company_id.resource_calendar_id
-            expected_attendances = calendar._attendance_intervals_batch(
-                start, stop, emp.resource_id
-            )[emp.resource_id.id]
-            # Substract Global Leaves and Employee's Leaves
-            leave_intervals = calendar._leave_intervals_batch(
-                start, stop, emp.resource_id, domain=AND([
-                    self._get_overtime_leave_domain(),
-                    [('company_id', 'in', [False, emp.company_id.id])],
-                ])
-            )
-            expected_attendances -= leave_intervals[False] | leave_intervals[emp.resource_id.id]
+                attendances_per_day[attendance.check_in_date] += attendance
 
-            # working_times = {date: [(start, stop)]}
-            working_times = defaultdict(lambda: [])
-            for expected_attendance in expected_attendances:
-                # Exclude resource.calendar.attendance
-                working_times[expected_attendance[0].date()].append(expected_attendance[:2])
+            # working_times = {date: [(start, stop)]} and lunch_times = {date: [(start, stop)]} in epoch seconds
+            working_times = {day: planned_days[emp.id, day][0] for day in attendance_dates}
+            lunch_times = {day: planned_days[emp.id, day][1] for day in attendance_dates}
 
             overtimes = self.env['hr.attendance.overtime'].sudo().search([
                 ('employee_id', '=', emp.id),
-                ('date', 'in', [day_data[1] for day_data in attendance_dates]),
+                ('date', 'in', list(attendance_dates)),
                 ('adjustment', '=', False),
             ])
 
             company_threshold = emp.company_id.overtime_company_threshold / 60.0
             employee_threshold = emp.company_id.overtime_employee_threshold / 60.0
 
-            for day_data in attendance_dates:
-                attendance_date = day_data[1]
+            # Overtime is not counted if any shift is not closed or if there are no attendances for that day,
+            # this could happen when deleting attendances.
+            closed_days = [
+                day for day in attendance_dates
+                if attendances_per_day.get(day) and all(attendances_per_day[day].mapped('check_out'))
+            ]
+            overtime_per_day = dict(zip(closed_days, compute_overtime([(
+                working_times[day],
+                [(pytz.utc.localize(attendance.check_in).timestamp(),
+                  pytz.utc.localize(attendance.check_out).timestamp(),
+                  attendance.worked_hours) for attendance in attendances_per_day[day]],
+                lunch_times[day],
+            ) for day in closed_days], company_threshold, employee_threshold)))
+
+            for attendance_date in attendance_dates:
                 attendances = attendances_per_day.get(attendance_date, self.browse())
                 unfinished_shifts = attendances.filtered(lambda a: not a.check_out)
-                overtime_duration = 0
-                overtime_duration_real = 0
-                # Overtime is not counted if any shift is not closed or if there are no attendances for that day,
-                # this could happen when deleting attendances.
-                if not unfinished_shifts and attendances:
-                    # The employee usually doesn't work on that day
-                    if not working_times[attendance_date]:
-                        # User does not have any resource_calendar_attendance for that day (week-end for example)
-                        overtime_duration = sum(attendances.mapped('worked_hours'))
-                        overtime_duration_real = overtime_duration
-                    # The employee usually work on that day
-                    else:
-                        # Compute start and end time for that day
-                        planned_start_dt, planned_end_dt = False, False
-                        planned_work_duration = 0
-                        for calendar_attendance in working_times[attendance_date]:
-                            planned_start_dt = min(planned_start_dt, calendar_attendance[0]) if planned_start_dt else calendar_attendance[0]
-                            planned_end_dt = max(planned_end_dt, calendar_attendance[1]) if planned_end_dt else calendar_attendance[1]
-                            planned_work_duration += (calendar_attendance[1] - calendar_attendance[0]).total_seconds() / 3600.0
-                        # Count time before, during and after 'working hours'
-                        pre_work_time, work_duration, post_work_time = 0, 0, 0
-
-                        for attendance in attendances:
-                            # consider check_in as planned_start_dt if within threshold
-                            # if delta_in < 0: Checked in after supposed start of the day
-                            # if delta_in > 0: Checked in before supposed start of the day
-                            local_check_in = pytz.utc.localize(attendance.check_in)
-                            delta_in = (planned_start_dt - local_check_in).total_seconds() / 3600.0
-
-                            # Started before or after planned date within the threshold interval
-                            if (delta_in > 0 and delta_in <= company_threshold) or\
-                                (delta_in < 0 and abs(delta_in) <= employee_threshold):
-                                local_check_in = planned_start_dt
-                            local_check_out = pytz.utc.localize(attendance.check_out)
-
-                            # same for check_out as planned_end_dt
-                            delta_out = (local_check_out - planned_end_dt).total_seconds() / 3600.0
-                            # if delta_out < 0: Checked out before supposed start of the day
-                            # if delta_out > 0: Checked out after supposed start of the day
-
-                            # Finised before or after planned date within the threshold interval
-                            if (delta_out > 0 and delta_out <= company_threshold) or\
-                                (delta_out < 0 and abs(delta_out) <= employee_threshold):
-                                local_check_out = planned_end_dt
-
-                            # There is an overtime at the start of the day
-                            if local_check_in < planned_start_dt:
-                                pre_work_time += (min(planned_start_dt, local_check_out) - local_check_in).total_seconds() / 3600.0
-                            # Interval inside the working hours -> Considered as working time
-                            if local_check_in <= planned_end_dt and local_check_out >= planned_start_dt:
-                                start_dt = max(planned_start_dt, local_check_in)
-                                stop_dt = min(planned_end_dt, local_check_out)
-                                work_duration += (stop_dt - start_dt).total_seconds() / 3600.0
-                                # remove lunch time from work duration
-                                lunch_intervals = calendar._attendance_intervals_batch(start_dt, stop_dt, emp.resource_id, lunch=True)
-                                work_duration -= sum((i[1] - i[0]).total_seconds() / 3600.0 for i in lunch_intervals[emp.resource_id.id])
-
-                            # There is an overtime at the end of the day
-                            if local_check_out > planned_end_dt:
-                                post_work_time += (local_check_out - max(planned_end_dt, local_check_in)).total_seconds() / 3600.0
-
-                        # Overtime within the planned work hours + overtime before/after work hours is > company threshold
-                        overtime_duration = work_duration - planned_work_duration
-                        if pre_work_time > company_threshold:
-                            overtime_duration += pre_work_time
-                        if post_work_time > company_threshold:
-                            overtime_duration += post_work_time
-                        # Global overtime including the thresholds
-                        overtime_duration_real = sum(attendances.mapped('worked_hours')) - planned_work_duration
+                overtime_duration, overtime_duration_real = overtime_per_day.get(attendance_date, (0, 0))
 
                 overtime = overtimes.filtered(lambda o: o.date == attendance_date)
                 if not float_is_zero(overtime_duration, 2) or unfinished_shifts:
@@ -391,10 +491,66 @@ class HrAttendance(models.Model):
         self.env.add_to_compute(self._fields['overtime_hours'],
                                 self.search([('employee_id', 'in', employees_worked_hours_to_compute)]))
 
+    def _recompute_planned_work(self):
+        """ Recompute the worked hours and the extra hours of the attendances after a change of their
+            planned days (calendar, leaves, timezone...), once per employee and local day.
+        """
+        attendances = self.sudo().exists()
+        if not attendances:
+            return
+        # Lunch breaks may have moved
+        self.env.add_to_compute(self._fields['worked_hours'], attendances)
+        attendances._update_overtime()
+
+    def init(self):
+        if not index_exists(self.env.cr, OPEN_ATTENDANCE_INDEX):
+            # Employees could have several open attendances before the index: only the latest
+            # one is kept open, the others are closed at their check in and flagged for review
+            self.env.cr.execute("""
+                UPDATE %s att
+                   SET check_out = att.check_in,
+                       check_out_date = att.check_in_date,
+                       worked_hours = 0,
+                       auto_checked_out = TRUE
+                 WHERE att.check_out IS NULL
+                   AND EXISTS (
+                        SELECT 1
+                          FROM %s latest
+                         WHERE latest.employee_id = att.employee_id
+                           AND latest.check_out IS NULL
+                           AND (latest.check_in, latest.id) > (att.check_in, att.id)
+                   )
+             RETURNING att.id""" % (self._table, self._table))
+            closed_ids = [row[0] for row in self.env.cr.fetchall()]
+            if closed_ids:
+                _logger.warning("Closed %s duplicated open attendances before creating %s: %s",
+                                len(closed_ids), OPEN_ATTENDANCE_INDEX, closed_ids)
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS %s
+            ON %s (employee_id)
+            WHERE check_out IS NULL""" % (OPEN_ATTENDANCE_INDEX, self._table))
+        # Serves the "latest attendance of the employee" lookups
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS hr_attendance_employee_check_in_index
+            ON %s (employee_id, check_in DESC)""" % (self._table))
+        # Serves the per employee and local day lookups of the extra hours
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS hr_attendance_employee_check_in_date_index
+            ON %s (employee_id, check_in_date)""" % (self._table))
+        # Serves the keyset pagination of the attendance history on (check_in, id)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS hr_attendance_check_in_id_index
+            ON %s (check_in DESC, id DESC)""" % (self._table))
+        presence_snapshots.init(self.env.cr)
+
     @api.model_create_multi
     def create(self, vals_list):
-        res = super().create(vals_list)
-        res._update_overtime()
+        open_checks = [(vals.get('employee_id') or self._default_employee().id, vals.get('check_in'))
+                       for vals in vals_list if not vals.get('check_out')]
+        with self._open_attendance_guard(open_checks):
+            res = super().create(vals_list)
+        res._schedule_overtime_update()
+        res._invalidate_presence_snapshots()
         return res
 
     def write(self, vals):
@@ -402,26 +558,311 @@ class HrAttendance(models.Model):
             vals['employee_id'] not in self.env.user.employee_ids.ids and \
             not self.env.user.has_group('company_connect.group_company_connect_hr_attendance_officer'):
             raise AccessError(_("Do not have access, user cannot edit the attendances that are not his own."))
+        # Correcting an automatic check out is its review
+        if 'check_out' in vals and 'auto_checked_out' not in vals:
+            vals = dict(vals, auto_checked_out=False)
         attendances_dates = self._get_attendances_dates()
-        result = super(HrAttendance, self).write(vals)
-        if any(field in vals for field in ['employee_id', 'check_in', 'check_out']):
-            # Merge attendance dates before and after write to recompute the
-            # overtime if the attendances have been moved to another day
-            for emp, dates in self._get_attendances_dates().items():
-                attendances_dates[emp] |= dates
-            self._update_overtime(attendances_dates)
+        if not any(field in vals for field in ['employee_id', 'check_in', 'check_out']):
+            return super(HrAttendance, self).write(vals)
+        self._invalidate_presence_snapshots()
+        open_checks = [(vals.get('employee_id') or attendance.employee_id.id, vals.get('check_in') or attendance.check_in)
+                       for attendance in self
+                       if not (vals['check_out'] if 'check_out' in vals else attendance.check_out)]
+        # Flushed right away, so that no later flush raises the violation of the open attendance index
+        with self._open_attendance_guard(open_checks):
+            result = super(HrAttendance, self).write(vals)
+            self.flush_recordset(['employee_id', 'check_in', 'check_out'])
+        self._invalidate_presence_snapshots()
+        # Merge attendance dates before and after write to recompute the
+        # overtime if the attendances have been moved to another day
+        for emp, dates in self._get_attendances_dates().items():
+            attendances_dates[emp] |= dates
+        self._schedule_overtime_update(attendances_dates)
         return result
 
     def unlink(self):
         attendances_dates = self._get_attendances_dates()
+        self._invalidate_presence_snapshots()
         res = super().unlink()
-        self._update_overtime(attendances_dates)
+        self._schedule_overtime_update(attendances_dates)
         return res
 
     @api.returns('self', lambda value: value.id)
     def copy(self, default=None):
         raise exceptions.UserError(_('You cannot duplicate an attendance.'))
 
+    def _schedule_overtime_update(self, employee_attendance_dates=None):
+        """ Recompute the extra hours, right away or, on the check in/out path (context key
+            'defer_overtime_update'), in the extra hours update cron so that the swipe transaction
+            does not hold the calendars, leaves and overtime rows of the employees. The extra hours
+            returned by a check in/out are then those from before it.
+        """
+        if employee_attendance_dates is None:
+            employee_attendance_dates = self._get_attendances_dates()
+        if not self.env.context.get('defer_overtime_update'):
+            self._update_overtime(employee_attendance_dates)
+            return
+        self.env['hr.attendance.overtime.queue'].sudo()._enqueue(employee_attendance_dates)
+
+    @api.model
+    def _cron_auto_check_out(self):
+        """ Close the attendances left open by a forgotten check out, in the companies using automatic
+            check out: at the end of the planned shift plus the tolerance of the company, but never
+            later than the maximum shift duration after the check in. Closed attendances are flagged
+            for review, and their extra hours recomputed once per employee and local day.
+        """
+        now = fields.Datetime.now()
+        self.env['res.company'].flush_model(['attendance_auto_check_out', 'attendance_auto_check_out_tolerance',
+                                             'attendance_auto_check_out_max_hours'])
+        self.env['hr.employee'].flush_model(['company_id'])
+        self.flush_model(['employee_id', 'check_in', 'check_out'])
+        self.env.cr.execute("""
+            SELECT att.id, company.attendance_auto_check_out_tolerance, company.attendance_auto_check_out_max_hours
+              FROM hr_attendance att
+              JOIN hr_employee emp ON emp.id = att.employee_id
+              JOIN res_company company ON company.id = emp.company_id
+             WHERE att.check_out IS NULL
+               AND company.attendance_auto_check_out
+               AND att.check_in < %s
+        """, (now,))
+        open_attendances = {att_id: (tolerance, max_hours) for att_id, tolerance, max_hours in self.env.cr.fetchall()}
+        if not open_attendances:
+            return
+        attendances = self.sudo().browse(open_attendances)
+
+        # Planned shifts starting on the local day of the check in, night shifts ending the day after
+        check_in_days = {attendance: attendance.check_in_date for attendance in attendances}
+        employee_days = defaultdict(set)
+        for attendance, day in check_in_days.items():
+            employee_days[attendance.employee_id].update((day, day + timedelta(days=1)))
+        planned_days = self.env['hr.attendance.planned.day']._get_planned_days(employee_days)
+
+        check_outs = {}
+        for attendance, day in check_in_days.items():
+            tolerance, max_hours = open_attendances[attendance.id]
+            check_in = pytz.utc.localize(attendance.check_in).timestamp()
+            day_work = planned_days[attendance.employee_id.id, day][0]
+            shift_end = None
+            if any(stop > check_in for _start, stop in day_work):
+                next_day_work = planned_days[attendance.employee_id.id, day + timedelta(days=1)][0]
+                shift_end = planned_shift_end(check_in, sorted(day_work + next_day_work))
+            check_out = check_in + max_hours * 3600
+            if shift_end is not None:
+                check_out = min(check_out, shift_end + tolerance * 3600)
+            check_out = datetime.utcfromtimestamp(check_out).replace(microsecond=0)
+            if attendance.check_in < check_out <= now:
+                check_outs[attendance.id] = check_out
+        if not check_outs:
+            return
+
+        # Serialized with the swipes, an attendance closed meanwhile is left untouched
+        attendances.browse(check_outs).employee_id._lock_attendances()
+        self.env.cr.execute("""
+            UPDATE hr_attendance att
+               SET check_out = closing.check_out,
+                   auto_checked_out = true,
+                   write_uid = %s,
+                   write_date = %s
+              FROM unnest(%s::int[], %s::timestamp[]) AS closing(id, check_out)
+             WHERE att.id = closing.id
+               AND att.check_out IS NULL
+         RETURNING att.id
+        """, (self.env.uid, now, list(check_outs), list(check_outs.values())))
+        closed = self.sudo().browse([row[0] for row in self.env.cr.fetchall()])
+        attendances.invalidate_recordset(['check_out', 'auto_checked_out', 'write_uid', 'write_date'])
+        closed.modified(['check_out', 'auto_checked_out'])
+
+        self.env['hr.attendance.audit'].sudo()._log([
+            (attendance, 'check_out', False, attendance.check_out) for attendance in closed
+        ], 'auto_check_out')
+        closed._update_overtime()
+        closed._invalidate_presence_snapshots()
+        _logger.info("Automatic check out of %s forgotten attendances", len(closed))
+
+    def _invalidate_presence_snapshots(self):
+        if self:
+            presence_snapshots.invalidate(self.env.cr)
+
+    @api.model
+    def get_attendance_history(self, employee_ids=None, department_ids=None, date_from=None, date_to=None,
+                               cursor=None, limit=80):
+        """ Returns a page of the attendances the user can see, most recent first, using keyset
+            pagination on (check_in, id): every page costs the same whatever its depth.
+
+            :param date_from, date_to: optional period of the check ins, in local days of the employees
+            :param cursor: the 'next_cursor' of the previous page, None for the first page
+            :return: {'rows': [{id, employee_id, check_in, check_out, worked_hours, overtime_hours, day}],
+                      'next_cursor': cursor of the next page or False}
+            The 'day' of a row is the local day of its check in for the employee, as for the extra hours.
+        """
+        limit = self._check_attendance_history_limit(limit)
+        domain = []
+        if employee_ids:
+            domain = AND([domain, [('employee_id', 'in', employee_ids)]])
+        if department_ids:
+            domain = AND([domain, [('employee_id.department_id', 'child_of', department_ids)]])
+        try:
+            date_from, date_to = fields.Date.to_date(date_from), fields.Date.to_date(date_to)
+        except (TypeError, ValueError):
+            raise exceptions.UserError(_('Invalid attendance history period: %s - %s', date_from, date_to))
+        if date_from:
+            domain = AND([domain, [('check_in_date', '>=', date_from)]])
+        if date_to:
+            domain = AND([domain, [('check_in_date', '<=', date_to)]])
+
+        query = self._search(domain, order='check_in desc, id desc', limit=limit + 1)
+        if cursor:
+            try:
+                cursor_check_in, cursor_id = cursor.rsplit(',', 1)
+                cursor_values = (fields.Datetime.to_datetime(cursor_check_in), int(cursor_id))
+            except (AttributeError, TypeError, ValueError):
+                cursor_values = None
+            if not cursor_values or not cursor_values[0]:
+                raise exceptions.UserError(_('Invalid attendance history cursor: %s', cursor))
+            query.add_where('("hr_attendance"."check_in", "hr_attendance"."id") < (%s, %s)', cursor_values)
+        attendances = self.browse(query)
+        attendances.fetch(['employee_id', 'check_in', 'check_out', 'check_in_date', 'worked_hours', 'overtime_hours'])
+
+        page, next_cursor = attendances[:limit], False
+        if len(attendances) > limit:
+            next_cursor = '%s,%s' % (fields.Datetime.to_string(page[-1].check_in), page[-1].id)
+        return {
+            'rows': [{
+                'id': attendance.id,
+                'employee_id': attendance.employee_id.id,
+                'check_in': fields.Datetime.to_string(attendance.check_in),
+                'check_out': fields.Datetime.to_string(attendance.check_out),
+                'worked_hours': float_round(attendance.worked_hours, 2),
+                'overtime_hours': float_round(attendance.overtime_hours, 2),
+                'day': fields.Date.to_string(attendance.check_in_date),
+            } for attendance in page],
+            'next_cursor': next_cursor,
+        }
+
+    @api.model
+    def _check_attendance_history_limit(self, limit, max_limit=ATTENDANCE_HISTORY_MAX_LIMIT):
+        """ Returns the page size asked by a client of the attendance history, bounded to [1, max_limit] """
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise exceptions.UserError(_('Invalid attendance history page size: %s', limit))
+        return max(1, min(limit, max_limit))
+
+    @api.model
+    def _get_payroll_export_header(self):
+        return [
+            _('Employee'), _('Department'), _('Company'), _('Day'),
+            _('Check In (local)'), _('Check Out (local)'), _('Worked Hours'), _('Extra Hours'),
+            _('Day Extra Hours'), _('Day Adjustment Hours'), _('Adjusted'),
+        ]
+
+    @api.model
+    def _iter_payroll_export_rows(self, date_from, date_to, company_ids, department_ids=None):
+        """ Yields the payroll export rows of the attendances and overtime of the employees of the
+            given companies (and departments) whose local day is within [date_from, date_to].
+
+            Rows are read by batches from a server-side cursor, hence memory stays bounded whatever
+            the period. The day of an attendance is the local day of its check in (check_in_date),
+            and the day level overtime is reported on its first attendance.
+            The generator must be consumed within the transaction of self.env.cr.
+
+            Only the allowed companies of the user are exported, and the employees, attendances and
+            overtime are restricted by the ORM searches, hence by the record rules, of the user.
+        """
+        self.flush_model()
+        self.env['hr.attendance.overtime'].flush_model()
+        self.env['hr.employee'].flush_model(['company_id', 'department_id', 'resource_id', 'resource_calendar_id'])
+        employee_domain = [('company_id', 'in', [company_id for company_id in company_ids
+                                                 if company_id in self.env.companies.ids])]
+        if department_ids:
+            employee_domain.append(('department_id', 'in', list(department_ids)))
+        employee_query = self.env['hr.employee'].with_context(active_test=False)._search(employee_domain)
+        attendance_query = self._search([('check_in_date', '>=', date_from), ('check_in_date', '<=', date_to)])
+        overtime_query = self.env['hr.attendance.overtime']._search([('date', '>=', date_from), ('date', '<=', date_to)])
+        if employee_query.is_empty():
+            return
+        cursor_name = 'company_connect_payroll_export_%s' % uuid.uuid4().hex
+        self.env.cr.execute(SQL("""
+            DECLARE {cursor} NO SCROLL CURSOR FOR
+               WITH employee AS (
+                    SELECT emp.id,
+                           COALESCE(res.tz, calendar.tz, company_calendar.tz, 'UTC') AS tz
+                      FROM hr_employee emp
+                      JOIN resource_resource res ON res.id = emp.resource_id
+                      JOIN res_company company ON company.id = emp.company_id
+                 LEFT JOIN resource_calendar calendar ON calendar.id = emp.resource_calendar_id
+                 LEFT JOIN resource_calendar company_calendar ON company_calendar.id = company.resource_calendar_id
+                     WHERE emp.id IN %s
+               ),
+               attendance AS (
+                    SELECT att.employee_id,
+                           att.check_in_date AS day,
+                           att.check_in AT TIME ZONE 'UTC' AT TIME ZONE employee.tz AS check_in,
+                           att.check_out AT TIME ZONE 'UTC' AT TIME ZONE employee.tz AS check_out,
+                           att.worked_hours,
+                           att.overtime_hours,
+                           ROW_NUMBER() OVER (PARTITION BY att.employee_id, att.check_in_date ORDER BY att.check_in) AS day_sequence
+                      FROM hr_attendance att
+                      JOIN employee ON employee.id = att.employee_id
+                     WHERE att.id IN %s
+               ),
+               overtime AS (
+                    SELECT ot.employee_id,
+                           ot.date,
+                           1 AS day_sequence,
+                           SUM(ot.duration) FILTER (WHERE NOT ot.adjustment) AS extra_hours,
+                           SUM(ot.duration) FILTER (WHERE ot.adjustment) AS adjustment_hours,
+                           BOOL_OR(ot.adjustment) AS adjusted
+                      FROM hr_attendance_overtime ot
+                      JOIN employee ON employee.id = ot.employee_id
+                     WHERE ot.id IN %s
+                  GROUP BY ot.employee_id, ot.date
+               )
+             SELECT COALESCE(att.employee_id, ot.employee_id),
+                    COALESCE(att.day, ot.date),
+                    att.check_in,
+                    att.check_out,
+                    att.worked_hours,
+                    att.overtime_hours,
+                    ot.extra_hours,
+                    ot.adjustment_hours,
+                    COALESCE(ot.adjusted, FALSE)
+               FROM attendance att
+    FULL OUTER JOIN overtime ot
+                 ON ot.employee_id = att.employee_id
+                AND ot.date = att.day
+                AND ot.day_sequence = att.day_sequence
+           ORDER BY 1, 2, 3
+        """.format(cursor=cursor_name), employee_query.subselect(), attendance_query.subselect(),
+            overtime_query.subselect()))
+        try:
+            while True:
+                self.env.cr.execute("FETCH %s FROM %s" % (PAYROLL_EXPORT_BATCH_SIZE, cursor_name))
+                rows = self.env.cr.fetchall()
+                if not rows:
+                    break
+                # Names are read once per batch, and forgotten afterwards
+                employees = self.env['hr.employee'].browse({row[0] for row in rows})
+                employees.fetch(['name', 'department_id', 'company_id'])
+                for employee_id, day, check_in, check_out, worked_hours, overtime_hours, extra_hours, adjustment_hours, adjusted in rows:
+                    employee = employees.browse(employee_id)
+                    yield [
+                        employee.name,
+                        employee.department_id.name or '',
+                        employee.company_id.name,
+                        day,
+                        check_in,
+                        check_out,
+                        float_round(worked_hours or 0.0, 2),
+                        float_round(overtime_hours or 0.0, 2),
+                        float_round(extra_hours or 0.0, 2),
+                        float_round(adjustment_hours or 0.0, 2),
+                        adjusted,
+                    ]
+                employees.invalidate_recordset()
+        finally:
+            self.env.cr.execute("CLOSE %s" % cursor_name)
+
     def action_in_attendance_maps(self):
         self.ensure_one()
         return {
@@ -465,7 +906,447 @@ class HrAttendanceOvertime(models.Model):
             CREATE UNIQUE INDEX IF NOT EXISTS hr_attendance_overtime_unique_employee_per_day
             ON %s (employee_id, date)
             WHERE adjustment is false""" % (self._table))
-        
+
+
+class HrAttendanceOvertimeQueue(models.Model):
+    _name = "hr.attendance.overtime.queue"
+    _description = "Attendance Extra Hours Update Queue"
+    # Filled by the check in/out and emptied by the extra hours update cron, both in SQL
+    _log_access = False
+
+    employee_id = fields.Many2one('hr.employee', string="Employee", required=True, ondelete='cascade', readonly=True)
+    date = fields.Date(string="Day", required=True, readonly=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS hr_attendance_overtime_queue_unique_employee_day
+            ON %s (employee_id, date)""" % (self._table))
+
+    @api.model
+    def _enqueue(self, employee_attendance_dates):
+        """ Queue the local days whose extra hours must be recomputed, and trigger the cron
+
+            :param employee_attendance_dates: {employee: set of local dates}
+        """
+        keys = [(employee.id, day) for employee, days in employee_attendance_dates.items() for day in days]
+        if not keys:
+            return
+        self.env.cr.execute("""
+            INSERT INTO hr_attendance_overtime_queue (employee_id, date)
+                 SELECT * FROM unnest(%s::int[], %s::date[])
+            ON CONFLICT DO NOTHING
+        """, ([key[0] for key in keys], [key[1] for key in keys]))
+        self.env.ref('company_connect.ir_cron_attendance_overtime_update').sudo()._trigger()
+
+    @api.model
+    def _cron_update_overtime(self):
+        """ Recompute the extra hours of the queued days, a batch per transaction. A batch of employees
+            swiping meanwhile fails to lock them and is retried in a new transaction.
+        """
+        tries = 0
+        while True:
+            try:
+                self.env.cr.execute("""
+                    DELETE FROM hr_attendance_overtime_queue
+                     WHERE id IN (SELECT id
+                                    FROM hr_attendance_overtime_queue
+                                ORDER BY employee_id, date
+                                   LIMIT %s
+                                     FOR UPDATE SKIP LOCKED)
+                 RETURNING employee_id, date
+                """, (OVERTIME_UPDATE_BATCH_SIZE,))
+                dates_per_employee = defaultdict(set)
+                for employee_id, day in self.env.cr.fetchall():
+                    dates_per_employee[employee_id].add(day)
+                if not dates_per_employee:
+                    return
+                employees = self.env['hr.employee'].browse(dates_per_employee).exists()
+                employees._lock_attendances()
+                self.env['hr.attendance']._update_overtime({
+                    employee: dates_per_employee[employee.id] for employee in employees})
+                self.env.cr.commit()
+                tries = 0
+            except (psycopg2.errors.SerializationFailure, psycopg2.errors.UniqueViolation):
+                # Another update of the same employees was committed after our snapshot
+                self.env.cr.rollback()
+                tries += 1
+                if tries == OVERTIME_UPDATE_TRIES:
+                    _logger.warning("Extra hours update postponed after %s failed attempts", tries)
+                    self.env.ref('company_connect.ir_cron_attendance_overtime_update')._trigger(
+                        fields.Datetime.now() + timedelta(minutes=1))
+                    return
+
+
+class HrAttendanceAudit(models.Model):
+    _name = "hr.attendance.audit"
+    _description = "Attendance Audit Log"
+    _order = 'date desc, id desc'
+    # Append-only and written on every swipe: no create/write metadata
+    _log_access = False
+
+    date = fields.Datetime(string="Date", required=True, readonly=True)
+    attendance_id = fields.Many2one('hr.attendance', string="Attendance", ondelete='set null', index=True, readonly=True)
+    employee_id = fields.Many2one('hr.employee', string="Employee", ondelete='cascade', index=True, readonly=True)
+    field = fields.Selection([
+        ('check_in', "Check In"),
+        ('check_out', "Check Out"),
+    ], string="Field", required=True, readonly=True)
+    old_value = fields.Datetime(string="Old Value", readonly=True)
+    new_value = fields.Datetime(string="New Value", readonly=True)
+    user_id = fields.Many2one('res.users', string="User", readonly=True)
+    source = fields.Selection([
+        ('kiosk', "Kiosk"),
+        ('systray', "Systray"),
+        ('auto_check_out', "Automatic Check Out"),
+    ], string="Source", required=True, readonly=True)
+
+    @api.model
+    def _log(self, changes, source):
+        """ Append the changes, as (attendance, field, old value, new value), in a single insert """
+        if not changes:
+            return
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            INSERT INTO %s (date, attendance_id, employee_id, field, old_value, new_value, user_id, source)
+            VALUES %s
+        """ % (self._table, ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(changes))), [
+            value
+            for attendance, field, old_value, new_value in changes
+            for value in (now, attendance.id, attendance.employee_id.id, field,
+                          old_value or None, new_value or None, self.env.uid, source)
+        ])
+
+    def write(self, vals):
+        raise exceptions.UserError(_('The attendance audit log cannot be modified.'))
+
+
+class HrAttendancePlannedDay(models.Model):
+    _name = "hr.attendance.planned.day"
+    _description = "Planned Working Day"
+    _order = 'date desc'
+    # Maintained by SQL only, from the calendars and leaves
+    _log_access = False
+
+    employee_id = fields.Many2one('hr.employee', string="Employee", required=True, ondelete='cascade', readonly=True)
+    date = fields.Date(string="Day", required=True, readonly=True)
+    work_intervals = fields.Json(string="Work Intervals", readonly=True,
+        help="[start, stop] in epoch seconds of the planned work starting this local day, leaves excluded")
+    lunch_intervals = fields.Json(string="Lunch Intervals", readonly=True,
+        help="[start, stop] in epoch seconds of the lunch breaks starting this local day")
+    planned_hours = fields.Float(string="Planned Hours", readonly=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS hr_attendance_planned_day_unique_employee_day
+            ON %s (employee_id, date)""" % (self._table))
+        # Row per employee updated by the invalidations of their days, see _get_planned_days
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS hr_attendance_planned_day_version (
+                employee_id integer PRIMARY KEY REFERENCES hr_employee (id) ON DELETE CASCADE,
+                version integer NOT NULL
+            )""")
+
+    @api.model
+    def _get_planned_days(self, employee_days):
+        """ Returns the planned work and lunch intervals of the employees on their local days, as
+            {(employee_id, date): (work_intervals, lunch_intervals)} of [start, stop] in epoch seconds.
+            Days not planned yet are computed from the calendars and leaves, and stored.
+
+            Days computed from calendars and leaves read before an invalidation committed must not be
+            stored: the version rows of the employees are share-locked first, which waits for a running
+            invalidation of their days and raises a serialization failure (the request is retried) if one
+            committed meanwhile. Rows are created on first use, an invalidation committed since then
+            makes the creation fail the same way.
+
+            :param employee_days: {employee: iterable of local dates}
+        """
+        keys = list({(employee.id, day) for employee, days in employee_days.items() for day in days})
+        if not keys:
+            return {}
+        self.env.cr.execute("""
+            SELECT planned.employee_id, planned.date, planned.work_intervals, planned.lunch_intervals
+              FROM hr_attendance_planned_day planned
+              JOIN unnest(%s::int[], %s::date[]) AS wanted(employee_id, date)
+                ON wanted.employee_id = planned.employee_id
+               AND wanted.date = planned.date
+        """, ([key[0] for key in keys], [key[1] for key in keys]))
+        planned_days = {(employee_id, day): (work, lunches) for employee_id, day, work, lunches in self.env.cr.fetchall()}
+
+        missing_days = defaultdict(set)
+        for employee, days in employee_days.items():
+            missing_days[employee].update(day for day in days if (employee.id, day) not in planned_days)
+        missing_days = {employee: days for employee, days in missing_days.items() if days}
+        if missing_days:
+            computed_days = self._compute_planned_days(missing_days)
+            employee_ids = sorted(employee.id for employee in missing_days)
+            self.env.cr.execute("""
+                INSERT INTO hr_attendance_planned_day_version (employee_id, version)
+                SELECT unnest(%s::int[]), 0
+                ON CONFLICT DO NOTHING
+            """, (employee_ids,))
+            self.env.cr.execute("""
+                SELECT version
+                  FROM hr_attendance_planned_day_version
+                 WHERE employee_id = ANY(%s)
+              ORDER BY employee_id
+                   FOR SHARE
+            """, (employee_ids,))
+            self.env.cr.execute("""
+                INSERT INTO hr_attendance_planned_day (employee_id, date, work_intervals, lunch_intervals, planned_hours)
+                VALUES %s
+                ON CONFLICT (employee_id, date) DO NOTHING
+            """ % ", ".join(["(%s, %s, %s::jsonb, %s::jsonb, %s)"] * len(computed_days)), [
+                value
+                for (employee_id, day), (work, lunches) in computed_days.items()
+                for value in (employee_id, day, json.dumps(work), json.dumps(lunches),
+                              sum(stop - start for start, stop in work) / 3600.0)
+            ])
+            planned_days.update(computed_days)
+        return planned_days
+
+    @api.model
+    def _compute_planned_days(self, employee_days):
+        """ Expands the calendars and leaves of the employees on the given local days, in one batch per
+            (calendar, company, first day, last day), see _get_planned_days.
+        """
+        employees_per_calendar = defaultdict(lambda: self.env['hr.employee'])
+        for employee, days in employee_days.items():
+            employee = employee.sudo()
+            calendar = employee.resource_calendar_id or employee.company_id.resource_calendar_id
+            employees_per_calendar[calendar, employee.company_id, min(days), max(days)] |= employee
+        planned_days = {}
+        for (calendar, company, first_day, last_day), employees in employees_per_calendar.items():
+            work_per_day, lunches_per_day = defaultdict(list), defaultdict(list)
+            if calendar:
+                # From the first local midnight to the last one of the employees, whatever their timezone
+                bounds = []
+                for employee in employees:
+                    tz = pytz.timezone(employee._get_tz())
+                    bounds.append(tz.localize(datetime.combine(first_day, datetime.min.time())))
+                    bounds.append(tz.localize(datetime.combine(last_day + timedelta(days=1), datetime.min.time())))
+                start, stop = min(bounds), max(bounds)
+                resources = employees.resource_id
+                leave_domain = AND([
+                    self.env['hr.attendance']._get_overtime_leave_domain(),
+                    [('company_id', 'in', [False, company.id])],
+                ])
+                work = calendar._attendance_intervals_batch(start, stop, resources)
+                leaves = calendar._leave_intervals_batch(start, stop, resources, domain=leave_domain)
+                lunches = calendar._attendance_intervals_batch(start, stop, resources, lunch=True)
+                # Intervals are expressed in the timezone of each resource, hence attached to its local days
+                for resource in resources:
+                    for interval in work[resource.id] - leaves[resource.id]:
+                        work_per_day[resource.id, interval[0].date()].append([interval[0].timestamp(), interval[1].timestamp()])
+                    for interval in lunches[resource.id]:
+                        lunches_per_day[resource.id, interval[0].date()].append([interval[0].timestamp(), interval[1].timestamp()])
+            for employee in employees:
+                for day in employee_days[employee]:
+                    key = (employee.resource_id.id, day)
+                    planned_days[employee.id, day] = (work_per_day[key], lunches_per_day[key])
+        return planned_days
+
+    @api.model
+    def _invalidate_planned_days(self, employee_ids=None, resource_ids=None, calendar_ids=None, company_ids=None,
+                                 date_from=None, date_to=None):
+        """ Drops the planned days matching all the given criteria, to be computed again when needed.
+            Calendars match the employees working with them, directly or through their company.
+            Dates are widened by a day on each side to cover every timezone.
+
+            :return: the dropped days, as {employee_id: set of local dates}
+        """
+        employee_conditions, employee_params = [], []
+        if employee_ids is not None:
+            employee_conditions.append("emp.id = ANY(%s)")
+            employee_params.append(list(employee_ids))
+        if resource_ids is not None:
+            employee_conditions.append("emp.resource_id = ANY(%s)")
+            employee_params.append(list(resource_ids))
+        if calendar_ids is not None:
+            employee_conditions.append("COALESCE(emp.resource_calendar_id, company.resource_calendar_id) = ANY(%s)")
+            employee_params.append(list(calendar_ids))
+        if company_ids is not None:
+            employee_conditions.append("emp.company_id = ANY(%s)")
+            employee_params.append(list(company_ids))
+        date_conditions, date_params = [], []
+        if date_from:
+            date_conditions.append("planned.date >= %s")
+            date_params.append(fields.Date.to_date(date_from) - timedelta(days=1))
+        if date_to:
+            date_conditions.append("planned.date <= %s")
+            date_params.append(fields.Date.to_date(date_to) + timedelta(days=1))
+        self.env['hr.employee'].flush_model(['resource_id', 'resource_calendar_id', 'company_id'])
+        self.env['res.company'].flush_model(['resource_calendar_id'])
+        # Only the employees concerned conflict with the computes of their days, see _get_planned_days
+        self.env.cr.execute("""
+            INSERT INTO hr_attendance_planned_day_version (employee_id, version)
+                 SELECT emp.id, 1
+                   FROM hr_employee emp
+                   JOIN res_company company ON company.id = emp.company_id
+                  WHERE TRUE %s
+               ORDER BY emp.id
+            ON CONFLICT (employee_id) DO UPDATE SET version = hr_attendance_planned_day_version.version + 1
+        """ % "".join("AND %s " % condition for condition in employee_conditions), employee_params)
+        self.env.cr.execute("""
+            DELETE FROM hr_attendance_planned_day planned
+             USING hr_employee emp
+              JOIN res_company company ON company.id = emp.company_id
+             WHERE emp.id = planned.employee_id
+               %s
+         RETURNING planned.employee_id, planned.date
+        """ % "".join("AND %s " % condition for condition in employee_conditions + date_conditions),
+            employee_params + date_params)
+        dropped_days = defaultdict(set)
+        for employee_id, day in self.env.cr.fetchall():
+            dropped_days[employee_id].add(day)
+        return dropped_days
+
+    @api.model
+    def _get_planned_attendances(self, employee_ids=None, resource_ids=None, calendar_ids=None, company_ids=None,
+                                 date_from=None, date_to=None):
+        """ Returns the attendances worked on the planned days matching all the given criteria, see
+            _invalidate_planned_days. Dates are widened by two days on each side to cover every timezone
+            and the attendances spanning midnight.
+        """
+        domain = []
+        if employee_ids is not None:
+            domain.append(('employee_id', 'in', list(employee_ids)))
+        if resource_ids is not None:
+            domain.append(('employee_id.resource_id', 'in', list(resource_ids)))
+        if calendar_ids is not None:
+            domain += ['|', ('employee_id.resource_calendar_id', 'in', list(calendar_ids)),
+                       '&', ('employee_id.resource_calendar_id', '=', False),
+                            ('employee_id.company_id.resource_calendar_id', 'in', list(calendar_ids))]
+        if company_ids is not None:
+            domain.append(('employee_id.company_id', 'in', list(company_ids)))
+        if date_from:
+            domain.append(('check_in', '>=', fields.Date.to_date(date_from) - timedelta(days=2)))
+        if date_to:
+            domain.append(('check_in', '<', fields.Date.to_date(date_to) + timedelta(days=2)))
+        return self.env['hr.attendance'].sudo().with_context(active_test=False).search(domain)
+
+    @api.model
+    def _update_planned_days(self, **criteria):
+        """ Drops the planned days matching the criteria, see _invalidate_planned_days, then recomputes the
+            worked hours and extra hours of the attendances worked on them. Only the days planned so far
+            are concerned: the extra hours of the older days, beyond PLANNED_DAYS_RETENTION, are kept.
+        """
+        dropped_days = self._invalidate_planned_days(**criteria)
+        if not dropped_days:
+            return
+        keys = [(employee_id, day) for employee_id, days in dropped_days.items() for day in days]
+        self.env['hr.attendance'].flush_model(['employee_id', 'check_in_date', 'check_out_date'])
+        self.env.cr.execute("""
+            SELECT att.id
+              FROM hr_attendance att
+              JOIN unnest(%s::int[], %s::date[]) AS dropped(employee_id, date)
+                ON dropped.employee_id = att.employee_id
+               AND dropped.date IN (att.check_in_date, att.check_out_date)
+        """, ([key[0] for key in keys], [key[1] for key in keys]))
+        self.env['hr.attendance'].browse({row[0] for row in self.env.cr.fetchall()})._recompute_planned_work()
+
+    @api.autovacuum
+    def _gc_planned_days(self):
+        # Old days are only needed again by a full rebuild of the extra hours, which plans them again
+        self.env.cr.execute("DELETE FROM hr_attendance_planned_day WHERE date < %s",
+                            (fields.Date.today() - timedelta(days=PLANNED_DAYS_RETENTION),))
+
+
+class ResourceCalendar(models.Model):
+    _inherit = 'resource.calendar'
+
+    def write(self, vals):
+        # The attendance lines written through the calendar are updated once for the whole write
+        # instead of once per type of command; the leaves are handled by their own hooks
+        res = super(ResourceCalendar, self.with_context(defer_planned_days_update=True)).write(vals)
+        if 'tz' in vals:
+            employees = self.env['hr.employee'].sudo().with_context(active_test=False).search([
+                '|', ('resource_calendar_id', 'in', self.ids),
+                     ('company_id.resource_calendar_id', 'in', self.ids),
+            ])
+            self.env['hr.attendance']._update_local_dates(employees.ids)
+        if any(field in vals for field in ['attendance_ids', 'tz', 'two_weeks_calendar']):
+            self._update_planned_days()
+        return res
+
+    def _update_planned_days(self):
+        # Deferred to the calendar write when the lines are written through it
+        if self and not self.env.context.get('defer_planned_days_update'):
+            self.env['hr.attendance.planned.day']._update_planned_days(calendar_ids=self.ids)
+
+
+class ResourceCalendarAttendance(models.Model):
+    _inherit = 'resource.calendar.attendance'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        res.calendar_id._update_planned_days()
+        return res
+
+    def write(self, vals):
+        calendars = self.calendar_id
+        res = super().write(vals)
+        (calendars | self.calendar_id)._update_planned_days()
+        return res
+
+    def unlink(self):
+        calendars = self.calendar_id
+        res = super().unlink()
+        calendars._update_planned_days()
+        return res
+
+
+class ResourceCalendarLeaves(models.Model):
+    _inherit = 'resource.calendar.leaves'
+
+    def _invalidate_planned_days(self):
+        """ Drops the planned days covered by the leaves, returns the attendances worked on them """
+        PlannedDay = self.env['hr.attendance.planned.day']
+        attendances = self.env['hr.attendance'].sudo()
+        for leave in self:
+            criteria = {'date_from': leave.date_from, 'date_to': leave.date_to}
+            if leave.resource_id:
+                criteria['resource_ids'] = leave.resource_id.ids
+            else:
+                if leave.calendar_id:
+                    criteria['calendar_ids'] = leave.calendar_id.ids
+                if leave.company_id:
+                    criteria['company_ids'] = leave.company_id.ids
+            PlannedDay._invalidate_planned_days(**criteria)
+            attendances |= PlannedDay._get_planned_attendances(**criteria)
+        return attendances
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        res._invalidate_planned_days()._recompute_planned_work()
+        return res
+
+    def write(self, vals):
+        attendances = self._invalidate_planned_days()
+        res = super().write(vals)
+        (attendances | self._invalidate_planned_days())._recompute_planned_work()
+        return res
+
+    def unlink(self):
+        attendances = self._invalidate_planned_days()
+        res = super().unlink()
+        attendances._recompute_planned_work()
+        return res
+
+
+class ResourceResource(models.Model):
+    _inherit = 'resource.resource'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'calendar_id' in vals or 'tz' in vals:
+            employees = self.env['hr.employee'].sudo().with_context(active_test=False).search([('resource_id', 'in', self.ids)])
+            self.env['hr.attendance']._update_local_dates(employees.ids)
+            self.env['hr.attendance.planned.day']._update_planned_days(resource_ids=self.ids)
+        return res
+
+
 class HrEmployeeBase(models.AbstractModel):
     _inherit = "hr.employee.base"
 
@@ -476,16 +1357,69 @@ class HrEmployeeBase(models.AbstractModel):
         Attendance has the second highest priority after login
         """
         super()._compute_presence_state()
-        employees = self.filtered(lambda e: e.hr_presence_state != "present")
-        employee_to_check_working = self.filtered(lambda e: e.attendance_state == "checked_out"
-                                                            and e.hr_presence_state == "to_define")
-        working_now_list = employee_to_check_working._get_employee_working_now()
-        for employee in employees:
-            if employee.attendance_state == "checked_out" and employee.hr_presence_state == "to_define" and \
-                    employee.id in working_now_list:
-                employee.hr_presence_state = "absent"
-            elif employee.attendance_state == "checked_in":
+        snapshots = {}
+        for employee in self.filtered(lambda e: e.hr_presence_state != "present"):
+            company_id = employee.company_id.id
+            if company_id not in snapshots:
+                snapshots[company_id] = self._get_presence_snapshot(company_id)
+            checked_in_ids, working_now_ids = snapshots[company_id]
+            if employee.id in checked_in_ids:
                 employee.hr_presence_state = "present"
+            elif employee.hr_presence_state == "to_define" and employee.id in working_now_ids:
+                employee.hr_presence_state = "absent"
+
+    def _get_employee_working_now(self):
+        employees_per_company = defaultdict(list)
+        for employee in self:
+            employees_per_company[employee.company_id.id].append(employee.id)
+        working_now = []
+        for company_id, employee_ids in employees_per_company.items():
+            working_now_ids = self._get_presence_snapshot(company_id)[1]
+            working_now += [employee_id for employee_id in employee_ids if employee_id in working_now_ids]
+        return working_now
+
+    @api.model
+    def _get_presence_snapshot(self, company_id):
+        """ Returns the ids of the employees of the company who are checked in and of those
+            who should be working now, cached for PRESENCE_SNAPSHOT_TTL seconds or until an
+            attendance changes in any worker.
+        """
+        return presence_snapshots.get(self.env.cr, company_id, lambda: self._compute_presence_snapshot(company_id))
+
+    @api.model
+    def _compute_presence_snapshot(self, company_id):
+        self.env['hr.attendance'].flush_model(['employee_id', 'check_out'])
+        self.env.cr.execute("""
+            SELECT att.employee_id
+              FROM hr_attendance att
+              JOIN hr_employee emp ON emp.id = att.employee_id
+             WHERE att.check_out IS NULL
+               AND emp.company_id = %s
+        """, (company_id,))
+        checked_in_ids = frozenset(row[0] for row in self.env.cr.fetchall())
+        employees = self.env['hr.employee'].sudo().with_context(active_test=False).search([('company_id', '=', company_id)])
+        working_now_ids = frozenset(employees._get_planned_working_now())
+        return checked_in_ids, working_now_ids
+
+    def _get_planned_working_now(self):
+        """ Returns the ids of the employees who should be working within the next hour, read from
+            their planned days instead of expanding their calendars.
+        """
+        now = fields.Datetime.now()
+        start, stop = pytz.utc.localize(now).timestamp(), pytz.utc.localize(now + timedelta(hours=1)).timestamp()
+        HrAttendance = self.env['hr.attendance']
+        # Intervals are attached to the local day they start on: yesterday's may still run (night shifts)
+        employee_days = {}
+        for employee in self:
+            today = HrAttendance._get_day_start_and_day(employee, now)[1]
+            in_one_hour = HrAttendance._get_day_start_and_day(employee, now + timedelta(hours=1))[1]
+            employee_days[employee] = {today - timedelta(days=1), today, in_one_hour}
+        planned_days = self.env['hr.attendance.planned.day']._get_planned_days(employee_days)
+        return [
+            employee.id for employee, days in employee_days.items()
+            if any(work_start < stop and work_stop > start
+                   for day in days for work_start, work_stop in planned_days[employee.id, day][0])
+        ]
 
     def _compute_presence_icon(self):
         res = super()._compute_presence_icon()
@@ -555,28 +1489,22 @@ class HrEmployee(models.Model):
 
     @api.model_create_multi
     def create(self, vals_list):
-        officer_group = self.env.ref('company_connect.group_company_connect_hr_attendance_officer', raise_if_not_found=False)
-        group_updates = []
-        for vals in vals_list:
-            if officer_group and vals.get('attendance_manager_id'):
-                group_updates.append((4, vals['attendance_manager_id']))
-        if group_updates:
-            officer_group.sudo().write({'users': group_updates})
-        return super().create(vals_list)
+        employees = super().create(vals_list)
+        employees.attendance_manager_id.sudo()._update_attendance_officers()
+        return employees
 
     def write(self, values):
         old_officers = self.env['res.users']
         if 'attendance_manager_id' in values:
             old_officers = self.attendance_manager_id
-            # Officer was added
-            if values['attendance_manager_id']:
-                officer = self.env['res.users'].browse(values['attendance_manager_id'])
-                officers_group = self.env.ref('company_connect.group_company_connect_hr_attendance_officer', raise_if_not_found=False)
-                if officers_group and not officer.has_group('company_connect.group_company_connect_hr_attendance_officer'):
-                    officer.sudo().write({'groups_id': [(4, officers_group.id)]})
 
         res = super(HrEmployee, self).write(values)
-        old_officers.sudo()._clean_attendance_officers()
+        if 'attendance_manager_id' in values:
+            (old_officers | self.attendance_manager_id).sudo()._update_attendance_officers()
+        if 'company_id' in values:
+            # The company calendar (and its timezone) and leaves may not apply anymore
+            self.env['hr.attendance']._update_local_dates(self.ids)
+            self.env['hr.attendance.planned.day']._update_planned_days(employee_ids=self.ids)
 
         return res
 
@@ -642,10 +1570,21 @@ class HrEmployee(models.Model):
 
     @api.depends('attendance_ids')
     def _compute_last_attendance_id(self):
+        last_attendance_per_employee = {}
+        employee_ids = self._origin.ids
+        if employee_ids:
+            # The search applies the record rules of the attendances, as before
+            query = self.env['hr.attendance']._search([('employee_id', 'in', employee_ids)])
+            if not query.is_empty():
+                self.env['hr.attendance'].flush_model(['employee_id', 'check_in'])
+                last_attendance_per_employee = dict(self.env.execute_query(SQL("""
+                    SELECT DISTINCT ON (employee_id) employee_id, id
+                      FROM hr_attendance
+                     WHERE id IN %s
+                  ORDER BY employee_id, check_in DESC
+                """, query.subselect())))
         for employee in self:
-            employee.last_attendance_id = self.env['hr.attendance'].search([
-                ('employee_id', '=', employee.id),
-            ], order="check_in desc", limit=1)
+            employee.last_attendance_id = last_attendance_per_employee.get(employee._origin.id, False)
 
     @api.depends('last_attendance_id.check_in', 'last_attendance_id.check_out', 'last_attendance_id')
     def _compute_attendance_state(self):
@@ -659,9 +1598,27 @@ class HrEmployee(models.Model):
             Check Out: modify check_out field of appropriate attendance record
         """
         self.ensure_one()
+        # Concurrent swipes of the same employee are serialized, those of other employees never wait
+        self._lock_attendances()
         action_date = fields.Datetime.now()
-
-        if self.attendance_state != 'checked_in':
+        Attendance = self.env['hr.attendance'].with_context(defer_overtime_update=True)
+        # Automated swipes can be audited in a compact log instead of the chatter
+        source = geo_information and geo_information.get('mode')
+        audit_log = source in ('kiosk', 'systray') and self.company_id.attendance_audit_mode == 'log'
+        if audit_log:
+            Attendance = Attendance.with_context(tracking_disable=True)
+
+        # Single probe on the open attendance index: an open attendance means the employee is checked in.
+        # The check out branch always has the attendance to close, hence no "could not find corresponding
+        # check in" error anymore (it reported an attendance_state out of sync with the attendances).
+        attendance = Attendance.search([('employee_id', '=', self.id), ('check_out', '=', False)], limit=1)
+        # A kiosk swipe repeating the previous one (double swipe, several kiosks) is ignored
+        if source == 'kiosk':
+            last_swipe = attendance.check_in if attendance else self.sudo().last_check_out
+            dedup_delay = timedelta(seconds=self.company_id.attendance_swipe_dedup_delay)
+            if dedup_delay and last_swipe and last_swipe > action_date - dedup_delay:
+                return attendance or self.sudo().last_attendance_id.with_env(self.env)
+        if not attendance:
             if geo_information:
                 vals = {
                     'employee_id': self.id,
@@ -673,25 +1630,115 @@ class HrEmployee(models.Model):
                     'employee_id': self.id,
                     'check_in': action_date,
                 }
-            return self.env['hr.attendance'].create(vals)
-        attendance = self.env['hr.attendance'].search([('employee_id', '=', self.id), ('check_out', '=', False)], limit=1)
-        if attendance:
-            if geo_information:
-                attendance.write({
-                    'check_out': action_date,
-                    **{'out_%s' % key: geo_information[key] for key in geo_information}
-                })
-            else:
-                attendance.write({
-                    'check_out': action_date
-                })
+            attendance = Attendance.create(vals)
+            if audit_log:
+                self.env['hr.attendance.audit'].sudo()._log([(attendance, 'check_in', False, action_date)], source)
+            self._notify_attendance_state('checked_in')
+            return attendance
+        if geo_information:
+            attendance.write({
+                'check_out': action_date,
+                **{'out_%s' % key: geo_information[key] for key in geo_information}
+            })
         else:
-            raise exceptions.UserError(_(
-                'Cannot perform check out on %(empl_name)s, could not find corresponding check in. '
-                'Your attendances have probably been modified manually by human resources.',
-                empl_name=self.sudo().name))
+            attendance.write({
+                'check_out': action_date
+            })
+        if audit_log:
+            self.env['hr.attendance.audit'].sudo()._log([(attendance, 'check_out', False, action_date)], source)
+        self._notify_attendance_state('checked_out')
         return attendance
 
+    def _notify_attendance_state(self, attendance_state):
+        """ Tells the systray of the user of the employee that it checked in or out, once the swipe is
+            committed. The systray fetches the rest of its data itself.
+        """
+        employee = self.sudo()
+        if not employee.user_id or not employee.company_id.attendance_from_systray:
+            return
+        partner_id = employee.user_id.partner_id.id
+        payload = {'id': self.id, 'attendance_state': attendance_state}
+        registry = self.env.registry
+
+        @self.env.cr.postcommit.add
+        def notify():
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env['bus.bus']._sendone(env['res.partner'].browse(partner_id),
+                                        'company_connect.attendance_state', payload)
+
+    def _lock_attendances(self):
+        """ Serialize the check in/out of the employees with transaction level advisory locks, taken
+            by id order to avoid deadlocks between multi-employee transactions.
+
+            The employee rows are not locked, so that swipes and HR edits never wait for each other. A
+            swipe committed while waiting for the lock, hence unseen by the transaction snapshot, makes
+            a check out fail with a serialization failure (the request is retried) and a check in with
+            the open attendance index.
+        """
+        if not self:
+            return
+        self.env.cr.execute("""
+            SELECT pg_advisory_xact_lock(%s, id)
+              FROM (SELECT unnest(%s::int[]) AS id ORDER BY 1) AS ids
+        """, (ATTENDANCE_LOCK_NAMESPACE, sorted(self.ids)))
+
+    def _get_attendance_info(self, with_avatar=True):
+        """ Returns the attendance data displayed by the kiosk and the systray """
+        self.ensure_one()
+        info = {
+            'id': self.id,
+            'employee_name': self.name,
+            'hours_today': float_round(self.hours_today, precision_digits=2),
+            'total_overtime': float_round(self.total_overtime, precision_digits=2),
+            'last_attendance_worked_hours': float_round(self.last_attendance_worked_hours, precision_digits=2),
+            'last_check_in': fields.Datetime.to_string(self.last_check_in),
+            'attendance_state': self.attendance_state,
+            'hours_previously_today': float_round(self.hours_previously_today, precision_digits=2),
+            'kiosk_delay': self.company_id.attendance_kiosk_delay * 1000,
+            'attendance': {'check_in': fields.Datetime.to_string(self.last_attendance_id.check_in),
+                           'check_out': fields.Datetime.to_string(self.last_attendance_id.check_out)},
+            'overtime_today': self.env['hr.attendance.overtime'].sudo().search([
+                ('employee_id', '=', self.id), ('date', '=', fields.Date.today()),
+                ('adjustment', '=', False)]).duration or 0,
+            'use_pin': self.company_id.attendance_kiosk_use_pin,
+            'display_systray': self.company_id.attendance_from_systray,
+            'display_overtime': self.company_id.hr_attendance_display_overtime
+        }
+        if with_avatar:
+            info['employee_avatar'] = self.image_1920
+        return info
+
+    def _get_systray_attendance_info(self):
+        """ Returns the attendance data displayed by the systray, a subset of _get_attendance_info """
+        self.ensure_one()
+        return {
+            'id': self.id,
+            'hours_today': float_round(self.hours_today, precision_digits=2),
+            'last_attendance_worked_hours': float_round(self.last_attendance_worked_hours, precision_digits=2),
+            'last_check_in': fields.Datetime.to_string(self.last_check_in),
+            'attendance_state': self.attendance_state,
+            'hours_previously_today': float_round(self.hours_previously_today, precision_digits=2),
+            'display_systray': self.company_id.attendance_from_systray,
+        }
+
+    def _rebuild_overtime(self):
+        """ Recompute from scratch the extra hours and the attendances overtime hours of the employees.
+            Manual adjustments are kept. The result only depends on the attendances, calendars and leaves
+            of each employee, so employees can be rebuilt in any grouping and order.
+        """
+        self.env['hr.attendance.overtime'].sudo().search([
+            ('employee_id', 'in', self.ids),
+            ('adjustment', '=', False),
+        ]).unlink()
+        attendances = self.env['hr.attendance'].sudo().search([
+            ('employee_id', 'in', self.filtered('company_id.hr_attendance_overtime').ids),
+        ], order='employee_id, check_in')
+        attendances._update_overtime()
+        # Attendances whose day has no overtime left are not recomputed by _update_overtime
+        self.env.add_to_compute(attendances._fields['overtime_hours'], attendances)
+        self.env.flush_all()
+
     def action_open_last_month_attendances(self):
         self.ensure_one()
         return {
@@ -741,6 +1788,24 @@ class ResCompany(models.Model):
         ('back', 'Back Camera'),
     ], string='Barcode Source', default='front')
     attendance_kiosk_delay = fields.Integer(default=10)
+    attendance_swipe_dedup_delay = fields.Integer(
+        string="Double Swipe Delay", default=10,
+        help="A kiosk check in/out of an employee this number of seconds after the previous one is ignored.")
+    attendance_audit_mode = fields.Selection([
+        ('chatter', 'Chatter'),
+        ('log', 'Audit Log'),
+    ], string="Kiosk & Systray Audit", default='chatter', required=True,
+        help="Chatter: check ins/outs from the kiosk and the systray are tracked in the chatter of the attendance.\n"
+             "Audit Log: they are recorded in a compact audit log instead; manual edits stay tracked in the chatter.")
+    attendance_auto_check_out = fields.Boolean(
+        string="Automatic Check Out",
+        help="Close the attendances left open by a forgotten check out, and flag them for review.")
+    attendance_auto_check_out_tolerance = fields.Float(
+        string="Automatic Check Out Tolerance", default=2.0,
+        help="Hours after the end of the planned shift before an open attendance is closed, at that end plus this tolerance.")
+    attendance_auto_check_out_max_hours = fields.Float(
+        string="Maximum Shift Duration", default=12.0,
+        help="Hours after the check in an open attendance is closed at, when no planned shift ends sooner.")
     attendance_kiosk_key = fields.Char(default=lambda s: uuid.uuid4().hex, copy=False, groups='company_connect.group_company_connect_hr_attendance_manager')
     attendance_kiosk_url = fields.Char(compute="_compute_attendance_kiosk_url")
     attendance_kiosk_use_pin = fields.Boolean(string='Employee PIN Identification')
@@ -815,6 +1880,10 @@ class ResCompany(models.Model):
                         ('date', '<', start_date)]])
 
         res = super().write(vals)
+        if 'resource_calendar_id' in vals:
+            employees = self.env['hr.employee'].sudo().with_context(active_test=False).search([('company_id', 'in', self.ids)])
+            self.env['hr.attendance']._update_local_dates(employees.ids)
+            self.env['hr.attendance.planned.day']._update_planned_days(company_ids=self.ids)
         if delete_domain:
             self.env['hr.attendance.overtime'].search(delete_domain).unlink()
         if search_domain:
@@ -849,6 +1918,11 @@ class ResConfigSettings(models.TransientModel):
     attendance_kiosk_mode = fields.Selection(related='company_id.attendance_kiosk_mode', readonly=False)
     attendance_barcode_source = fields.Selection(related='company_id.attendance_barcode_source', readonly=False)
     attendance_kiosk_delay = fields.Integer(related='company_id.attendance_kiosk_delay', readonly=False)
+    attendance_swipe_dedup_delay = fields.Integer(related='company_id.attendance_swipe_dedup_delay', readonly=False)
+    attendance_audit_mode = fields.Selection(related='company_id.attendance_audit_mode', readonly=False)
+    attendance_auto_check_out = fields.Boolean(related='company_id.attendance_auto_check_out', readonly=False)
+    attendance_auto_check_out_tolerance = fields.Float(related='company_id.attendance_auto_check_out_tolerance', readonly=False)
+    attendance_auto_check_out_max_hours = fields.Float(related='company_id.attendance_auto_check_out_max_hours', readonly=False)
     attendance_kiosk_url = fields.Char(related='company_id.attendance_kiosk_url')
     attendance_kiosk_use_pin = fields.Boolean(related='company_id.attendance_kiosk_use_pin', readonly=False)
     attendance_from_systray = fields.Boolean(related="company_id.attendance_from_systray", readonly=False)
@@ -909,13 +1983,22 @@ class User(models.Model):
             'display_extra_hours',
         ]
 
-    def _clean_attendance_officers(self):
-        attendance_officers = self.env['hr.employee'].search(
-            [('attendance_manager_id', 'in', self.ids)]).attendance_manager_id
-        officers_to_remove_ids = self - attendance_officers
-        if officers_to_remove_ids:
-            self.env.ref('company_connect.group_company_connect_hr_attendance_officer').users = [(3, user.id) for user in
-                                                                               officers_to_remove_ids]
+    def _update_attendance_officers(self):
+        """ Add the users managing the attendances of an employee to the attendance officers group
+            and remove the others, with one grouped query and a single write on the group.
+        """
+        officers_group = self.env.ref('company_connect.group_company_connect_hr_attendance_officer', raise_if_not_found=False)
+        if not officers_group or not self:
+            return
+        attendance_officers = self.browse([manager.id for [manager] in self.env['hr.employee']._read_group(
+            [('attendance_manager_id', 'in', self.ids)], ['attendance_manager_id'])])
+        group_users = officers_group.users
+        officers_to_add = attendance_officers - group_users
+        officers_to_remove = (self - attendance_officers) & group_users
+        if officers_to_add or officers_to_remove:
+            officers_group.users = [(4, user.id) for user in officers_to_add] + \
+                                   [(3, user.id) for user in officers_to_remove]
+
     def action_open_last_month_attendances(self):
         self.ensure_one()
         return {
@@ -942,4 +2025,14 @@ class User(models.Model):
             },
             "domain": [('employee_id', '=', self.employee_id.id)]
         }
-    
\ No newline at end of file
+
+class IrHttp(models.AbstractModel):
+    _inherit = 'ir.http'
+
+    def session_info(self):
+        result = super().session_info()
+        # Initial state of the attendance systray, the check ins/outs are then pushed on the bus
+        employee = self.env.user.employee_id.sudo()
+        if self.env.user._is_internal() and employee and employee.company_id.attendance_from_systray:
+            result['attendance_user_data'] = employee._get_systray_attendance_info()
+        return result
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Worker level caches of values computed from the database.
+
+Every worker keeps its own entries, tagged with the version of the cache they were computed
+under. The versions are PostgreSQL sequences: bumping one is neither transactional nor
+locking, and the next read of any worker of the database drops the older entries.
+"""
+
+import time
+
+from odoo.sql_db import db_connect
+
+
+class SharedCache:
+    """ Values per key (company, user...) kept for ``ttl`` seconds at most, and dropped by all
+        the workers as soon as one of them calls :meth:`invalidate`.
+    """
+
+    def __init__(self, name, ttl):
+        self.sequence = 'company_connect_%s_cache_version' % name
+        self.ttl = ttl
+        # {(dbname, key): (expiration, version, value)}
+        self._entries = {}
+
+    def init(self, cr):
+        cr.execute("CREATE SEQUENCE IF NOT EXISTS %s" % self.sequence)
+
+    def get(self, cr, key, compute):
+        """ Returns the cached value of ``key``, computed by ``compute()`` when missing, expired
+            or outdated. Values computed by a transaction which invalidated the cache reflect its
+            uncommitted changes, hence are returned without being kept.
+        """
+        cr.execute("SELECT last_value FROM %s" % self.sequence)
+        version = cr.fetchone()[0]
+        entry = self._entries.get((cr.dbname, key))
+        if entry and entry[1] == version and entry[0] > time.monotonic():
+            return entry[2]
+        value = compute()
+        if self.sequence not in cr.postcommit.data.get('company_connect.cache_bumps', ()):
+            self._entries[(cr.dbname, key)] = (time.monotonic() + self.ttl, version, value)
+        return value
+
+    def invalidate(self, cr):
+        # Bumped right away so that the other workers stop serving their entries, and again once
+        # the transaction ends so that entries computed meanwhile from the previous state do not
+        # survive its commit
+        bumps = cr.postcommit.data.setdefault('company_connect.cache_bumps', set())
+        if self.sequence in bumps:
+            return
+        bumps.add(self.sequence)
+        cr.execute("SELECT nextval(%s)", [self.sequence])
+        dbname = cr.dbname
+
+        def bump():
+            with db_connect(dbname).cursor() as bump_cr:
+                bump_cr.execute("SELECT nextval(%s)", [self.sequence])
+        cr.postcommit.add(bump)
+        cr.postrollback.add(bump)
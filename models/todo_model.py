@@ -1,52 +1,159 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import api, models, _, _lt, Command, fields
+import psycopg2
+import re
+
+from odoo import api, models, modules, _, Command, fields
+from odoo.addons.company_connect.models.shared_cache import SharedCache
+from odoo.exceptions import AccessError, UserError
+from odoo.osv import expression
 from odoo.tools import html2plaintext
-from datetime import datetime
+
+# To-do counters of the activity menu per user
+TODO_COUNTERS_TTL = 60
+TODO_COUNTER_FIELDS = ['user_ids', 'state', 'stage_id', 'active', 'project_id', 'parent_id']
+todo_counters = SharedCache('todo_counters', TODO_COUNTERS_TTL)
+
+# Partial unique index allowing a single running session per to-do
+RUNNING_SESSION_INDEX = 'project_task_timer_session_unique_running'
+
+# Stages which started or stopped the timer by their (English) name before they had a timer action
+TIMER_ACTION_STAGE_NAMES = {
+    'start': ['In Progress'],
+    'stop': ['Changes Requested', 'Waiting', 'Cancelled', 'Done'],
+}
+
 
 class Task(models.Model):
     _inherit = 'project.task'
 
-    timer_start = fields.Datetime(string='Timer Start')
-    time_spent = fields.Float(string='Time Spent', compute='_calculate_time', store=True)
-    timer = fields.Boolean("Timer Running", default=False)
+    timer_session_ids = fields.One2many('project.task.timer.session', 'task_id', string='Timer Sessions')
+    timer_start = fields.Datetime(string='Timer Start', compute='_compute_timer')
+    time_spent = fields.Float(string='Time Spent', compute='_compute_time_spent', store=True)
+    timer = fields.Boolean("Timer Running", compute='_compute_timer', search='_search_timer')
+    todo_fulltext = fields.Char(string='Full Text', compute='_compute_todo_fulltext', search='_search_todo_fulltext')
+    todo_search_text = fields.Text(string='Plain Text Description', compute='_compute_todo_search_text', store=True)
+
+    def init(self):
+        super().init()
+        # Full-text vector over the name and the plain text of the description, maintained by PostgreSQL
+        self.env.cr.execute("""
+            ALTER TABLE %s ADD COLUMN IF NOT EXISTS todo_search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(todo_search_text, '')), 'B')
+            ) STORED""" % (self._table))
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS project_task_todo_search_vector_index
+            ON %s USING gin (todo_search_vector)""" % (self._table))
+        todo_counters.init(self.env.cr)
 
     @api.model_create_multi
     def create(self, vals_list):
+        # Batches usually share the same description, only derive each title once
+        names_per_description = {}
         for vals in vals_list:
             if not vals.get('name') and not vals.get('project_id') and not vals.get('parent_id'):
                 if vals.get('description'):
-                    # Generating name from first line of the description
-                    text = html2plaintext(vals['description'])
-                    name = text.strip().replace('*', '').partition("\n")[0]
-                    vals['name'] = (name[:97] + '...') if len(name) > 100 else name
+                    description = vals['description']
+                    if description not in names_per_description:
+                        names_per_description[description] = self._get_name_from_description(description)
+                    vals['name'] = names_per_description[description]
                 else:
                     vals['name'] = _('Untitled to-do')
-        return super().create(vals_list)
+        tasks = super().create(vals_list)
+        if tasks.user_ids:
+            todo_counters.invalidate(self.env.cr)
+        return tasks
+
+    @api.model
+    def _get_name_from_description(self, description):
+        # Generating name from first line of the description
+        name = html2plaintext(description).strip().replace('*', '').partition("\n")[0]
+        return (name[:97] + '...') if len(name) > 100 else name
+
+    @api.model
+    def _create_todo_activities(self, vals_list):
+        """ Creates a private to-do and its activity for each dictionary of vals_list, holding
+            the summary, note, date_deadline and user_id of the to-do. Only project administrators
+            can create to-dos for other users.
+
+            :return: the created to-dos
+        """
+        if any(vals['user_id'] != self.env.uid for vals in vals_list) and \
+                not self.env.user.has_group('project.group_project_manager'):
+            raise AccessError(_("Only project administrators can assign to-dos to other users."))
+        # The record rules of the private to-dos require their creator among the assignees
+        todos = self.sudo().create([{
+            'name': vals['summary'],
+            'description': vals.get('note'),
+            'date_deadline': vals['date_deadline'],
+            'user_ids': [Command.link(vals['user_id'])],
+        } for vals in vals_list])
+        res_model_id = self.env['ir.model']._get_id('project.task')
+        activity_type_id = self.env['mail.activity']._default_activity_type_for_model('project.task').id
+        self.env['mail.activity'].sudo().create([{
+            'res_model_id': res_model_id,
+            'res_id': todo.id,
+            'summary': vals['summary'],
+            'user_id': vals['user_id'],
+            'date_deadline': vals['date_deadline'],
+            'activity_type_id': activity_type_id,
+        } for todo, vals in zip(todos, vals_list)])
+        return todos.with_env(self.env)
 
     def _ensure_onboarding_todo(self):
         if not self.env.user.has_group('company_connect.group_onboarding_company_connect_todo'):
-            self._generate_onboarding_todo(self.env.user)
-            onboarding_group = self.env.ref('company_connect.group_onboarding_company_connect_todo').sudo()
-            onboarding_group.write({'users': [Command.link(self.env.user.id)]})
+            self._ensure_onboarding_todos(self.env.user)
+
+    @api.model
+    def _ensure_onboarding_todos(self, users):
+        """ Batched version of _ensure_onboarding_todo, for the users of an import for example """
+        onboarding_group = self.env.ref('company_connect.group_onboarding_company_connect_todo').sudo()
+        users = self.env['res.users'].sudo().search([
+            ('id', 'in', users.ids),
+            ('groups_id', 'not in', onboarding_group.ids),
+        ])
+        if not users:
+            return
+        self.sudo()._generate_onboarding_todos(users)
+        onboarding_group.write({'users': [Command.link(user.id) for user in users]})
 
     def _generate_onboarding_todo(self, user):
         user.ensure_one()
-        body = self.with_context(lang=user.lang or self.env.user.lang).env['ir.qweb']._render(
+        self._generate_onboarding_todos(user)
+
+    @api.model
+    def _generate_onboarding_todos(self, users):
+        # The template is rendered once per language, only the user name is substituted
+        placeholder = '__company_connect_onboarding_user_name__'
+        rendered_per_lang = {}
+        vals_list = []
+        for user in users:
+            lang = user.lang or self.env.user.lang
+            if lang not in rendered_per_lang:
+                rendered_per_lang[lang] = self.with_context(lang=lang)._render_onboarding_todo(placeholder)
+            body, title = rendered_per_lang[lang]
+            if not body:
+                continue
+            vals_list.append({
+                'user_ids': user.ids,
+                # Markup.replace escapes the user name
+                'description': body.replace(placeholder, user.name),
+                'name': title % user.name,
+            })
+        return self.env['project.task'].create(vals_list)
+
+    @api.model
+    def _render_onboarding_todo(self, user_name):
+        body = self.env['ir.qweb']._render(
             'company_connect.company_connect_todo_user_onboarding',
-            {'object': user},
+            {'object': self.env['res.users'].new({'name': user_name})},
             minimal_qcontext=True,
             raise_if_not_found=False
         )
-        if not body:
-            return
-        title = _lt('Welcome %s!', user.name)
-        self.env['project.task'].create([{
-            'user_ids': user.ids,
-            'description': body,
-            'name': title,
-        }])
+        return body, _('Welcome %s!')
 
     def action_convert_to_task(self):
         self.ensure_one()
@@ -59,47 +166,280 @@ class Task(models.Model):
         }
     
     def _start(self):
-        self.ensure_one()
-        if not self.timer:
-            self.timer_start = datetime.now()
-            self.timer = True
+        now = fields.Datetime.now()
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env['project.task.timer.session'].sudo().create([{
+                    'task_id': task.id,
+                    'user_id': self.env.uid,
+                    'start': now,
+                } for task in self.filtered(lambda task: not task.timer)])
+        except psycopg2.errors.UniqueViolation as e:
+            if e.diag.constraint_name != RUNNING_SESSION_INDEX:
+                raise
+            raise UserError(_("The timer of this to-do has just been started by someone else, please reload the page.")) from e
 
     def action_start(self):
         self._start()
 
     def _stop(self):
-        self.ensure_one()
-        if self.timer:
-            delta = datetime.now() - fields.Datetime.from_string(self.timer_start)
-            self.time_spent += delta.total_seconds() / 3600
-            self.timer = False
-        self.timer_start = False
-        
+        self.env['project.task.timer.session'].sudo().search([
+            ('task_id', 'in', self.ids),
+            ('stop', '=', False),
+        ]).write({'stop': fields.Datetime.now()})
+
     def action_stop(self):
         self._stop()
 
-    @api.depends('timer_start', 'timer')
-    def _calculate_time(self):
+    @api.depends('timer_session_ids.stop')
+    def _compute_timer(self):
+        running_sessions = self.env['project.task.timer.session'].sudo().search([
+            ('task_id', 'in', self._origin.ids),
+            ('stop', '=', False),
+        ])
+        timer_start_per_task = {session.task_id.id: session.start for session in running_sessions}
         for task in self:
-            if task.timer and task.timer_start:
-                delta = datetime.now() - fields.Datetime.from_string(task.timer_start)
-                task.time_spent += delta.total_seconds() / 3600
-                task.timer_start = fields.Datetime.now()
+            task.timer_start = timer_start_per_task.get(task._origin.id, False)
+            task.timer = bool(task.timer_start)
 
-    def write(self, vals):
+    def _search_timer(self, operator, value):
+        if operator in ('=', '!='):
+            values = {bool(value)}
+        elif operator in ('in', 'not in'):
+            values = {bool(item) for item in value}
+        else:
+            raise UserError(_('Operation not supported'))
+        if operator in ('!=', 'not in'):
+            values = {True, False} - values
+        if len(values) != 1:
+            return expression.TRUE_DOMAIN if values else expression.FALSE_DOMAIN
+        running = values.pop()
+        return [('timer_session_ids', 'any' if running else 'not any', [('stop', '=', False)])]
+
+    def _compute_todo_fulltext(self):
+        self.todo_fulltext = False
+
+    @api.depends('description')
+    def _compute_todo_search_text(self):
+        for task in self:
+            task.todo_search_text = html2plaintext(task.description) if task.description else False
+
+    @api.model
+    def _get_todo_tsquery(self, text):
+        # Prefix match on every word, so that results come while typing
+        words = re.findall(r'\w+', text or '')
+        return ' & '.join('%s:*' % word for word in words)
+
+    def _search_todo_fulltext(self, operator, value):
+        if operator not in ('ilike', '=', 'like', 'not ilike', '!=', 'not like') or not isinstance(value, str):
+            raise UserError(_('Operation not supported'))
+        negative = operator in ('not ilike', '!=', 'not like')
+        tsquery = self._get_todo_tsquery(value)
+        if not tsquery:
+            return expression.FALSE_DOMAIN if negative else expression.TRUE_DOMAIN
+        self.flush_model(['name', 'todo_search_text'])
+        query = self.sudo().with_context(active_test=False)._search([])
+        query.add_where('"project_task"."todo_search_vector" @@ to_tsquery(\'simple\', %s)', [tsquery])
+        return [('id', 'not in' if negative else 'in', query)]
+
+    @api.model
+    def web_search_read(self, domain, specification, offset=0, limit=None, order=None, count_limit=None):
+        # Full-text matches come best first, unless another order is asked for
+        if not order:
+            texts = [leaf[2] for leaf in domain
+                     if isinstance(leaf, (list, tuple)) and len(leaf) == 3 and leaf[0] == 'todo_fulltext'
+                     and leaf[1] in ('ilike', '=', 'like') and isinstance(leaf[2], str)]
+            tsquery = self._get_todo_tsquery(' '.join(texts))
+            if tsquery:
+                self = self.with_context(todo_fulltext_rank=tsquery)
+        return super(Task, self).web_search_read(domain, specification, offset=offset, limit=limit, order=order,
+                                                 count_limit=count_limit)
+
+    @api.model
+    def search_fetch(self, domain, field_names, offset=0, limit=None, order=None):
+        tsquery = self.env.context.get('todo_fulltext_rank')
+        if not tsquery:
+            return super().search_fetch(domain, field_names, offset=offset, limit=limit, order=order)
+        # Only the search of web_search_read is ranked, not the counts and reads following it
+        self = self.with_context(todo_fulltext_rank=False)
+        query = self._search(domain, offset=offset, limit=limit, order=order or self._order)
+        if query.is_empty():
+            return self.browse()
+        rank = self.env.cr.mogrify(
+            'ts_rank("project_task"."todo_search_vector", to_tsquery(\'simple\', %s)) DESC', [tsquery],
+        ).decode()
+        query.order = '%s, %s' % (rank, query.order)
+        return self._fetch_query(query, self._determine_fields_to_fetch(field_names))
+
+    @api.depends('timer_session_ids.duration')
+    def _compute_time_spent(self):
+        # Stored to be sorted and grouped on, hence the closed sessions only: running ones count once stopped
+        time_spent_per_task = {}
+        if self._origin.ids:
+            time_spent_per_task = {
+                task.id: duration
+                for task, duration in self.env['project.task.timer.session'].sudo()._read_group(
+                    [('task_id', 'in', self._origin.ids)], ['task_id'], ['duration:sum'])
+            }
         for task in self:
-            if 'stage_id' in vals:
-                new_stage = self.env['project.task.type'].browse(vals['stage_id'])
-                new_state = new_stage.name if new_stage else False
-                if new_state:
-                    if new_state == 'In Progress':
-                        task._start_timer()
-                    elif new_state in ['Changes Requested', 'Waiting', 'Cancelled', 'Done']:
-                        task._stop_timer()
-        return super(Task, self).write(vals)
+            task.time_spent = time_spent_per_task.get(task._origin.id, 0.0)
+
+    def write(self, vals):
+        if any(field in vals for field in TODO_COUNTER_FIELDS):
+            todo_counters.invalidate(self.env.cr)
+        res = super(Task, self).write(vals)
+        if vals.get('stage_id'):
+            # The stage is resolved once for the whole batch
+            timer_action = self.env['project.task.type'].browse(vals['stage_id']).timer_action
+            if timer_action == 'start':
+                self._start()
+            elif timer_action == 'stop':
+                self._stop()
+        return res
+
+    def unlink(self):
+        if self.user_ids:
+            todo_counters.invalidate(self.env.cr)
+        return super().unlink()
+
+    @api.model
+    def get_todo_counters(self):
+        """ Returns the number of open to-dos of the current user and the number of their
+            to-do activities per activity category, cached for TODO_COUNTERS_TTL seconds or
+            until a to-do or a to-do activity changes in any worker.
+        """
+        return dict(todo_counters.get(self.env.cr, self.env.uid, self._compute_todo_counters))
+
+    @api.model
+    def _compute_todo_counters(self):
+        self.env['project.task'].flush_model(['user_ids', 'project_id', 'parent_id', 'active', 'state'])
+        self.env['mail.activity'].flush_model()
+        active_activity = "AND act.active" if 'active' in self.env['mail.activity']._fields else ""
+        self.env.cr.execute("""
+            SELECT 'todo', COUNT(*)
+              FROM project_task task
+              JOIN project_task_user_rel rel ON rel.task_id = task.id
+             WHERE rel.user_id = %(user_id)s
+               AND task.project_id IS NULL
+               AND task.parent_id IS NULL
+               AND task.active
+               AND task.state NOT IN ('1_done', '1_canceled')
+         UNION ALL
+            SELECT COALESCE(act_type.category, 'default'), COUNT(*)
+              FROM mail_activity act
+         LEFT JOIN mail_activity_type act_type ON act_type.id = act.activity_type_id
+             WHERE act.user_id = %(user_id)s
+               AND act.res_model = 'project.task'
+               {active_activity}
+          GROUP BY 1
+        """.format(active_activity=active_activity), {'user_id': self.env.uid})
+        return dict(self.env.cr.fetchall())
+
+
+class TaskTimerSession(models.Model):
+    _name = 'project.task.timer.session'
+    _description = 'To-do Timer Session'
+    _order = 'start desc'
+    _rec_name = 'task_id'
+
+    task_id = fields.Many2one('project.task', string='To-do', required=True, ondelete='cascade', index=True)
+    user_id = fields.Many2one('res.users', string='User', required=True, default=lambda self: self.env.user, index=True)
+    start = fields.Datetime(required=True, default=fields.Datetime.now)
+    stop = fields.Datetime()
+    duration = fields.Float(compute='_compute_duration', store=True, help="Duration of the session in hours, 0 while it is running")
+
+    def init(self):
+        # Allows only 1 running session per to-do, also serves the running timers lookups
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS %s
+            ON %s (task_id)
+            WHERE stop IS NULL""" % (RUNNING_SESSION_INDEX, self._table))
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS project_task_timer_session_user_start_index
+            ON %s (user_id, start)""" % (self._table))
+
+    @api.depends('start', 'stop')
+    def _compute_duration(self):
+        for session in self:
+            if session.start and session.stop:
+                session.duration = (session.stop - session.start).total_seconds() / 3600
+            else:
+                session.duration = 0.0
+
+
+class TaskType(models.Model):
+    _inherit = 'project.task.type'
+
+    timer_action = fields.Selection([
+        ('start', 'Start Timer'),
+        ('stop', 'Stop Timer'),
+    ], string='Timer', help="Start or stop the timer of the tasks moved into this stage.")
+
+    @api.model
+    def _init_timer_actions(self):
+        """ Gives the stages without timer action the one their name used to trigger """
+        stages = self.with_context(lang='en_US', active_test=False)
+        for timer_action, names in TIMER_ACTION_STAGE_NAMES.items():
+            stages.search([('name', 'in', names), ('timer_action', '=', False)]).timer_action = timer_action
 
 
 class MailActivityType(models.Model):
     _inherit = "mail.activity.type"
 
-    category = fields.Selection(selection_add=[('reminder', 'Reminder')])
\ No newline at end of file
+    category = fields.Selection(selection_add=[('reminder', 'Reminder')])
+
+
+class MailActivity(models.Model):
+    _inherit = "mail.activity"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        activities = super().create(vals_list)
+        activities._invalidate_todo_counters()
+        return activities
+
+    def write(self, vals):
+        if 'user_id' in vals or 'res_model_id' in vals or 'active' in vals:
+            self._invalidate_todo_counters()
+        res = super().write(vals)
+        if 'user_id' in vals or 'res_model_id' in vals or 'active' in vals:
+            self._invalidate_todo_counters()
+        return res
+
+    def unlink(self):
+        self._invalidate_todo_counters()
+        return super().unlink()
+
+    def _invalidate_todo_counters(self):
+        if any(activity.res_model == 'project.task' for activity in self):
+            todo_counters.invalidate(self.env.cr)
+
+
+class User(models.Model):
+    _inherit = 'res.users'
+
+    @api.model
+    def systray_get_activities(self):
+        """ Serves the to-do counters of the activity menu with its activity groups, in the to-do
+            group (added when the user has open to-dos but no to-do activity).
+        """
+        activities = super().systray_get_activities()
+        counters = self.env['project.task'].get_todo_counters()
+        todo_group = next((group for group in activities if group.get('model') == 'project.task'), None)
+        if todo_group is None:
+            if not counters.get('todo'):
+                return activities
+            todo_group = {
+                'id': self.env['ir.model']._get_id('project.task'),
+                'name': _('To-Do'),
+                'model': 'project.task',
+                'type': 'activity',
+                'icon': modules.module.get_module_icon(self.env['project.task']._original_module),
+                'total_count': 0,
+                'today_count': 0,
+                'overdue_count': 0,
+                'planned_count': 0,
+            }
+            activities.append(todo_group)
+        todo_group['todo_counters'] = counters
+        return activities
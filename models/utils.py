@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" ORM-free overtime rules.
+
+Every time is expressed in epoch seconds (UTC) and every duration in hours, so that
+the rules can be run, tested and benchmarked on plain Python sequences without any database.
+"""
+
+# Planned intervals closer than this (lunch breaks, midnight of a night shift) belong to the same shift
+MAX_SHIFT_GAP = 2 * 3600
+
+
+def interval_overlap(start, stop, intervals):
+    """ Returns the number of seconds of [start, stop] covered by the given (start, stop) intervals. """
+    return sum(max(0.0, min(stop, interval_stop) - max(start, interval_start))
+               for interval_start, interval_stop in intervals)
+
+
+def compute_day_overtime(planned, attendances, lunches, company_threshold, employee_threshold):
+    """ Returns the (overtime, real overtime) hours of one local day.
+
+        :param planned: (start, stop) of the planned work intervals of the day, empty when the
+            employee is not supposed to work that day
+        :param attendances: (check_in, check_out, worked_hours) of the closed attendances of the day
+        :param lunches: (start, stop) of the lunch breaks of the day
+        :param company_threshold: tolerance in hours around the planned hours in favor of the company
+        :param employee_threshold: tolerance in hours around the planned hours in favor of the employee
+    """
+    worked_hours = sum(attendance[2] for attendance in attendances)
+    # The employee usually doesn't work on that day (week-end for example)
+    if not planned:
+        return worked_hours, worked_hours
+
+    planned_start = min(interval[0] for interval in planned)
+    planned_end = max(interval[1] for interval in planned)
+    planned_work_duration = sum(interval[1] - interval[0] for interval in planned) / 3600.0
+
+    # Count time before, during and after 'working hours'
+    pre_work_time, work_duration, post_work_time = 0.0, 0.0, 0.0
+    for check_in, check_out, _worked_hours in attendances:
+        # consider check_in as planned_start if within threshold
+        # if delta_in < 0: Checked in after supposed start of the day
+        # if delta_in > 0: Checked in before supposed start of the day
+        delta_in = (planned_start - check_in) / 3600.0
+        if (0 < delta_in <= company_threshold) or (delta_in < 0 and abs(delta_in) <= employee_threshold):
+            check_in = planned_start
+
+        # same for check_out as planned_end
+        delta_out = (check_out - planned_end) / 3600.0
+        if (0 < delta_out <= company_threshold) or (delta_out < 0 and abs(delta_out) <= employee_threshold):
+            check_out = planned_end
+
+        # There is an overtime at the start of the day
+        if check_in < planned_start:
+            pre_work_time += (min(planned_start, check_out) - check_in) / 3600.0
+        # Interval inside the working hours -> Considered as working time, without the lunch time
+        if check_in <= planned_end and check_out >= planned_start:
+            start = max(planned_start, check_in)
+            stop = min(planned_end, check_out)
+            work_duration += (stop - start - interval_overlap(start, stop, lunches)) / 3600.0
+        # There is an overtime at the end of the day
+        if check_out > planned_end:
+            post_work_time += (check_out - max(planned_end, check_in)) / 3600.0
+
+    # Overtime within the planned work hours + overtime before/after work hours is > company threshold
+    overtime = work_duration - planned_work_duration
+    if pre_work_time > company_threshold:
+        overtime += pre_work_time
+    if post_work_time > company_threshold:
+        overtime += post_work_time
+    return overtime, worked_hours - planned_work_duration
+
+
+def compute_overtime(days, company_threshold, employee_threshold):
+    """ Applies compute_day_overtime to each day in turn, a plain loop rather than a vectorized
+        computation (numpy is not a dependency of the addon).
+
+        :param days: (planned, attendances, lunches) of each day, see compute_day_overtime
+        :return: list of the (overtime, real overtime) hours of each day
+    """
+    return [
+        compute_day_overtime(planned, attendances, lunches, company_threshold, employee_threshold)
+        for planned, attendances, lunches in days
+    ]
+
+
+def planned_shift_end(check_in, intervals, max_gap=MAX_SHIFT_GAP):
+    """ Returns the end of the planned shift worked from check_in, or None when no planned interval
+        ends after it: the first interval ending after check_in, extended by the intervals following
+        it within max_gap seconds.
+
+        :param intervals: sorted (start, stop) of the planned work intervals
+    """
+    end = None
+    for start, stop in intervals:
+        if stop <= check_in:
+            continue
+        if end is not None and start - end > max_gap:
+            break
+        end = stop if end is None else max(end, stop)
+    return end
@@ -0,0 +1,126 @@
+/* Service worker of the public attendance kiosk, served by /company_connect/kiosk_service_worker.js
+ *
+ * - asset bundles (/web/assets/<hash>/...) and the company logo (?unique=<checksum>) are content
+ *   addressed: they are served from the cache and never revalidated;
+ * - the kiosk page (roster included) and the lazy bundle descriptions (/web/bundle/...) are served
+ *   from the cache at once and revalidated in the background. When the X-Kiosk-Version header of the
+ *   kiosk page changes, the open kiosks are told to reload and the asset bundles and logos it no
+ *   longer references are evicted. A kiosk page answered with a client error (kiosk key regenerated,
+ *   kiosk mode disabled) is dropped from the cache.
+ */
+
+const CACHE_PREFIX = "company_connect-kiosk-";
+const CACHE_NAME = CACHE_PREFIX + "1";
+const KIOSK_UPDATED = "company_connect.kiosk_updated";
+
+self.addEventListener("install", () => self.skipWaiting());
+
+self.addEventListener("activate", (event) => {
+    event.waitUntil(
+        (async () => {
+            for (const key of await caches.keys()) {
+                if (key.startsWith(CACHE_PREFIX) && key !== CACHE_NAME) {
+                    await caches.delete(key);
+                }
+            }
+            await self.clients.claim();
+        })()
+    );
+});
+
+function isContentAddressed(url) {
+    return (
+        url.pathname.startsWith("/web/assets/") ||
+        (url.pathname === "/web/binary/company_logo" && url.searchParams.get("unique"))
+    );
+}
+
+function isKioskPage(request, url) {
+    return request.mode === "navigate" && /^\/company_connect\/[^/]+$/.test(url.pathname);
+}
+
+function isCacheable(response) {
+    return response.ok && !response.redirected && response.type === "basic";
+}
+
+async function cacheFirst(request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (isCacheable(response)) {
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function notifyKioskUpdated() {
+    for (const client of await self.clients.matchAll({ type: "window" })) {
+        client.postMessage({ type: KIOSK_UPDATED });
+    }
+}
+
+async function evictUnreferenced(cache) {
+    // The kiosk pages and the bundle descriptions hold the URLs of the assets and the logo versions
+    const requests = await cache.keys();
+    let references = "";
+    for (const request of requests) {
+        if (!isContentAddressed(new URL(request.url))) {
+            const response = await cache.match(request);
+            references += response ? await response.text() : "";
+        }
+    }
+    for (const request of requests) {
+        const url = new URL(request.url);
+        const reference = url.searchParams.get("unique") || url.pathname;
+        if (isContentAddressed(url) && !references.includes(reference)) {
+            await cache.delete(request);
+        }
+    }
+}
+
+async function revalidate(request, cached) {
+    const cache = await caches.open(CACHE_NAME);
+    const response = await fetch(request);
+    if (isCacheable(response)) {
+        await cache.put(request, response.clone());
+        const version = response.headers.get("X-Kiosk-Version");
+        if (cached && version && version !== cached.headers.get("X-Kiosk-Version")) {
+            await evictUnreferenced(cache);
+            await notifyKioskUpdated();
+        }
+    } else if (response.status >= 400 && response.status < 500) {
+        await cache.delete(request);
+    }
+    return response;
+}
+
+async function staleWhileRevalidate(event) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(event.request);
+    const network = revalidate(event.request, cached);
+    if (cached) {
+        // A failed revalidation (e.g. network down) keeps serving the cached kiosk
+        event.waitUntil(network.catch(() => {}));
+        return cached;
+    }
+    return network;
+}
+
+self.addEventListener("fetch", (event) => {
+    const request = event.request;
+    if (request.method !== "GET") {
+        return;
+    }
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+    if (isContentAddressed(url)) {
+        event.respondWith(cacheFirst(request));
+    } else if (isKioskPage(request, url) || url.pathname.startsWith("/web/bundle/")) {
+        event.respondWith(staleWhileRevalidate(event));
+    }
+});
@@ -1,7 +1,7 @@
 /* @odoo-module */
 
 
-import { Component, useState } from "@odoo/owl";
+import { Component, onWillDestroy, useState } from "@odoo/owl";
 import { Dropdown } from "@web/core/dropdown/dropdown";
 import { DropdownItem } from "@web/core/dropdown/dropdown_item";
 import { deserializeDateTime } from "@web/core/l10n/dates";
@@ -9,6 +9,7 @@ import { registry } from "@web/core/registry";
 import { useService } from "@web/core/utils/hooks";
 import { useDebounced } from "@web/core/utils/timing";
 import { isIosApp } from "@web/core/browser/feature_detection";
+import { session } from "@web/session";
 const { DateTime } = luxon;
 
 export class ActivityMenu extends Component {
@@ -18,6 +19,7 @@ export class ActivityMenu extends Component {
 
     setup() {
         this.rpc = useService("rpc");
+        this.busService = useService("bus_service");
         this.ui = useState(useService("ui"));
         this.userService = useService("user");
         this.employee = false;
@@ -27,53 +29,63 @@ export class ActivityMenu extends Component {
         });
         this.date_formatter = registry.category("formatters").get("float_time")
         this.onClickSignInOut = useDebounced(this.signInOut, 200, true);
-        // load data but do not wait for it to render to prevent from delaying
-        // the whole webclient
-        this.searchReadEmployee();
+        // the initial data comes with the session info and the check ins/outs (kiosk,
+        // other tabs) are pushed on the bus, the data is only fetched when they change it
+        this.setEmployee(session.attendance_user_data || {});
+        const onAttendanceState = async ({ id, attendance_state }) => {
+            if (id === this.employee.id && attendance_state !== this.employee.attendance_state) {
+                this.setEmployee(await this.rpc("/company_connect/attendance_user_data"));
+            }
+        };
+        this.busService.subscribe("company_connect.attendance_state", onAttendanceState);
+        onWillDestroy(() => this.busService.unsubscribe("company_connect.attendance_state", onAttendanceState));
     }
 
-    async searchReadEmployee(){
-        const result = await this.rpc("/company_connect/attendance_user_data");
-        this.employee = result;
+    setEmployee(employee) {
+        this.employee = employee;
+        this.receivedAt = DateTime.now();
         if (this.employee.id) {
-            this.hoursToday = this.date_formatter(
-                this.employee.hours_today
-            );
-            this.hoursPreviouslyToday = this.date_formatter(
-                this.employee.hours_previously_today
-            );
-            this.lastAttendanceWorkedHours = this.date_formatter(
-                this.employee.last_attendance_worked_hours
-            );
             this.lastCheckIn = deserializeDateTime(this.employee.last_check_in).toLocaleString(DateTime.TIME_SIMPLE);
             this.state.checkedIn = this.employee.attendance_state === "checked_in";
             this.isFirstAttendance = this.employee.hours_previously_today === 0;
             this.state.isDisplayed = this.employee.display_systray
+            this.updateWorkedHours();
         }
     }
 
+    updateWorkedHours() {
+        // while checked in, the worked hours keep growing from the last received data
+        const elapsedHours = this.state.checkedIn ? DateTime.now().diff(this.receivedAt, "hours").hours : 0;
+        this.hoursToday = this.date_formatter(
+            this.employee.hours_today + elapsedHours
+        );
+        this.hoursPreviouslyToday = this.date_formatter(
+            this.employee.hours_previously_today
+        );
+        this.lastAttendanceWorkedHours = this.date_formatter(
+            this.employee.last_attendance_worked_hours + elapsedHours
+        );
+    }
+
     async signInOut() {
         // iOS app lacks permissions to call `getCurrentPosition`
         if (!isIosApp()) {
             navigator.geolocation.getCurrentPosition(
                 async ({coords: {latitude, longitude}}) => {
-                    await this.rpc("/company_connect/systray_check_in_out", {
+                    this.setEmployee(await this.rpc("/company_connect/systray_check_in_out", {
                         latitude,
                         longitude
-                    })
-                    await this.searchReadEmployee()
+                    }))
                 },
                 async err => {
-                    await this.rpc("/company_connect/systray_check_in_out")
-                    await this.searchReadEmployee()
+                    this.setEmployee(await this.rpc("/company_connect/systray_check_in_out"))
                 },
                 {
                     enableHighAccuracy: true,
                 }
             )
         } else {
-            await this.rpc("/company_connect/systray_check_in_out")
-            await this.searchReadEmployee()
+            this.setEmployee(await this.rpc("/company_connect/systray_check_in_out"))
         }
     }
 }
@@ -1,6 +1,7 @@
 /** @odoo-module **/
 
 import { BarcodeScanner } from "@barcodes/components/barcode_scanner";
+import { registry } from "@web/core/registry";
 
 export class KioskBarcodeScanner extends BarcodeScanner {
     get facingMode() {
@@ -14,3 +15,6 @@ KioskBarcodeScanner.props = {
     ...BarcodeScanner.props,
     barcodeSource: String,
 };
+
+// Lazy loaded by the public kiosk with the company_connect.assets_public_attendance_barcode bundle
+registry.category("lazy_components").add("KioskBarcodeScanner", KioskBarcodeScanner);
@@ -1,22 +1,22 @@
 /** @odoo-module **/
 
-import {App, whenReady, Component, useState} from "@odoo/owl";
+import {App, whenReady, Component, useExternalListener, useState} from "@odoo/owl";
 import { CardLayout } from "@company_connect/components/card_layout/card_layout";
 import { KioskManualSelection } from "@company_connect/components/manual_selection/manual_selection";
 import { makeEnv, startServices } from "@web/env";
-import { templates } from "@web/core/assets";
+import { browser } from "@web/core/browser/browser";
+import { LazyComponent, templates } from "@web/core/assets";
 import { _t } from "@web/core/l10n/translation";
 import { MainComponentsContainer } from "@web/core/main_components_container";
 import { useService, useBus } from "@web/core/utils/hooks";
 import { url } from "@web/core/utils/urls";
 import {KioskGreetings} from "@company_connect/components/greetings/greetings";
 import {KioskPinCode} from "@company_connect/components/pin_code/pin_code";
-import {KioskBarcodeScanner} from "@company_connect/components/kiosk_barcode/kiosk_barcode";
 
 class kioskAttendanceApp extends Component{
     static props = [];
     static components = {
-        KioskBarcodeScanner,
+        LazyComponent,
         CardLayout,
         KioskManualSelection,
         KioskGreetings,
@@ -30,8 +30,15 @@ class kioskAttendanceApp extends Component{
         this.notification = useService("notification");
         this.companyImageUrl = url("/web/binary/company_logo", {
             company: this.props.companyId,
+            unique: this.props.companyLogoVersion,
         });
         this.lockScanner = false;
+        this.kioskUpdated = false;
+        if ("serviceWorker" in navigator) {
+            useExternalListener(navigator.serviceWorker, "message", (ev) => this.onServiceWorkerMessage(ev));
+        }
+        // The camera reader (and ZXing) is only loaded when the kiosk scans with a camera
+        this.useCameraScanner = this.props.kioskMode !== 'manual' && this.props.barcodeSource !== 'scanner';
         if (this.props.kioskMode !== 'manual'){
             useBus(this.barcode.bus, "barcode_scanned", (ev) => this.onBarcodeScanned(ev.detail.barcode));
             this.state = useState({active_display: "main"});
@@ -67,7 +74,21 @@ class kioskAttendanceApp extends Component{
         }
     }
 
+    onServiceWorkerMessage(ev) {
+        if (ev.data && ev.data.type === "company_connect.kiosk_updated") {
+            // The cached kiosk already holds the new roster, reload it as soon as nobody is using it
+            this.kioskUpdated = true;
+            if (["main", "manual"].includes(this.state.active_display)) {
+                browser.location.reload();
+            }
+        }
+    }
+
     kioskReturn() {
+        if (this.kioskUpdated) {
+            browser.location.reload();
+            return;
+        }
         if (this.props.kioskMode !== 'manual'){
             this.switchDisplay('main')
         }else{
@@ -119,6 +140,11 @@ class kioskAttendanceApp extends Component{
 kioskAttendanceApp.template = "company_connect.public_kiosk_app";
 
 export async function createPublicKioskAttendance(document, kiosk_backend_info) {
+    if ("serviceWorker" in navigator) {
+        // The kiosk still works without it, only slower to reload
+        navigator.serviceWorker.register("/company_connect/kiosk_service_worker.js", { scope: "/company_connect/" })
+            .catch(() => {});
+    }
     await whenReady();
     const env = makeEnv();
     await startServices(env);
@@ -130,6 +156,7 @@ export async function createPublicKioskAttendance(document, kiosk_backend_info)
                 token : kiosk_backend_info.token,
                 companyId: kiosk_backend_info.company_id,
                 companyName: kiosk_backend_info.company_name,
+                companyLogoVersion: kiosk_backend_info.company_logo_version,
                 employees: kiosk_backend_info.employees,
                 departments: kiosk_backend_info.departments,
                 kioskMode: kiosk_backend_info.kiosk_mode,
@@ -3,6 +3,7 @@
 import { _t } from "@web/core/l10n/translation";
 import { ActivityMenu } from "@mail/core/web/activity_menu";
 import { FormViewDialog } from "@web/views/view_dialogs/form_view_dialog";
+import { useState } from "@odoo/owl";
 import { useCommand } from "@web/core/commands/command_hook";
 import { useService } from "@web/core/utils/hooks";
 import { patch } from "@web/core/utils/patch";
@@ -13,6 +14,7 @@ registry.category("command_categories").add("company_connect", {}, { sequence: 1
 
 patch(ActivityMenu.prototype, {
     setup() {
+        this.todoCounters = useState({ todo: 0, reminder: 0 });
         super.setup(...arguments);
         this.orm = useService("orm");
         this.dialogService = useService("dialog");
@@ -30,9 +32,18 @@ patch(ActivityMenu.prototype, {
         );
     },
 
+    async fetchSystrayActivities() {
+        await super.fetchSystrayActivities(...arguments);
+        // counters are cached per user on the server and served with the to-do group
+        const todoGroup = this.store.activityGroups.find((group) => group.todo_counters);
+        const counters = todoGroup ? todoGroup.todo_counters : {};
+        this.todoCounters.todo = counters.todo || 0;
+        this.todoCounters.reminder = counters.reminder || 0;
+    },
+
     async createActivityTodo() {
         const wizard = await this.orm.call("mail.activity.todo.create", "create", [{
-            "user_id": this.userId,
+            "user_ids": [[4, this.userId]],
         }]);
         this.dialogService.add(FormViewDialog, {
             title: _t("Add a To-Do"),
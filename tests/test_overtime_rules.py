@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo.addons.company_connect.models.utils import compute_day_overtime, compute_overtime, \
+    interval_overlap, planned_shift_end
+from odoo.tests.common import BaseCase
+
+H = 3600
+
+# 08:00-12:00 and 13:00-17:00 with a lunch break in between
+DAY_PLANNED = [(8 * H, 12 * H), (13 * H, 17 * H)]
+DAY_LUNCHES = [(12 * H, 13 * H)]
+
+# 22:00-02:00 and 03:00-06:00 the next day, with a break at 02:00
+NIGHT_PLANNED = [(22 * H, 26 * H), (27 * H, 30 * H)]
+NIGHT_LUNCHES = [(26 * H, 27 * H)]
+
+
+class TestOvertimeRules(BaseCase):
+
+    def assertOvertime(self, result, overtime, real_overtime):
+        self.assertAlmostEqual(result[0], overtime, places=6)
+        self.assertAlmostEqual(result[1], real_overtime, places=6)
+
+    def test_interval_overlap(self):
+        self.assertEqual(interval_overlap(10, 20, [(0, 12), (15, 30)]), 7)
+        self.assertEqual(interval_overlap(10, 20, [(0, 10), (20, 30)]), 0)
+        self.assertEqual(interval_overlap(10, 20, []), 0)
+
+    def test_day_off(self):
+        # Everything worked on a day without planned hours is overtime
+        result = compute_day_overtime([], [(8 * H, 12 * H, 4.0)], [], 0, 0)
+        self.assertOvertime(result, 4.0, 4.0)
+
+    def test_planned_day(self):
+        result = compute_day_overtime(DAY_PLANNED, [(8 * H, 17 * H, 8.0)], DAY_LUNCHES, 0, 0)
+        self.assertOvertime(result, 0.0, 0.0)
+
+    def test_day_overtime_after_work(self):
+        result = compute_day_overtime(DAY_PLANNED, [(8 * H, 19 * H, 10.0)], DAY_LUNCHES, 1.0, 0)
+        self.assertOvertime(result, 2.0, 2.0)
+
+    def test_lunch_overlap(self):
+        # The part of the attendances during the lunch break is not working time
+        attendances = [(8 * H, 12.5 * H, 4.5), (13.5 * H, 17 * H, 3.5)]
+        result = compute_day_overtime(DAY_PLANNED, attendances, DAY_LUNCHES, 0, 0)
+        self.assertOvertime(result, -0.5, 0.0)
+
+    def test_midnight_spanning_shift(self):
+        result = compute_day_overtime(NIGHT_PLANNED, [(22 * H, 30 * H, 7.0)], NIGHT_LUNCHES, 0, 0)
+        self.assertOvertime(result, 0.0, 0.0)
+        result = compute_day_overtime(NIGHT_PLANNED, [(21 * H, 30 * H, 8.0)], NIGHT_LUNCHES, 0, 0)
+        self.assertOvertime(result, 1.0, 1.0)
+
+    def test_company_threshold_edges(self):
+        # Checking in up to the company threshold early counts from the planned start
+        result = compute_day_overtime(DAY_PLANNED, [(7.75 * H, 17 * H, 8.25)], DAY_LUNCHES, 0.25, 0)
+        self.assertOvertime(result, 0.0, 0.25)
+        # One minute more and the whole early time is overtime
+        check_in = 7.75 * H - 60
+        result = compute_day_overtime(DAY_PLANNED, [(check_in, 17 * H, 8.25 + 1 / 60)], DAY_LUNCHES, 0.25, 0)
+        self.assertOvertime(result, 0.25 + 1 / 60, 0.25 + 1 / 60)
+        # Checking out up to the company threshold late counts until the planned end
+        result = compute_day_overtime(DAY_PLANNED, [(8 * H, 17.25 * H, 8.25)], DAY_LUNCHES, 0.25, 0)
+        self.assertOvertime(result, 0.0, 0.25)
+
+    def test_employee_threshold_edges(self):
+        threshold = 600 / H
+        # Checking in up to the employee threshold late counts from the planned start
+        result = compute_day_overtime(DAY_PLANNED, [(8 * H + 600, 17 * H, 8.0 - threshold)], DAY_LUNCHES, 0, threshold)
+        self.assertOvertime(result, 0.0, -threshold)
+        # One minute more and the missing time is deducted
+        result = compute_day_overtime(DAY_PLANNED, [(8 * H + 660, 17 * H, 8.0 - 660 / H)], DAY_LUNCHES, 0, threshold)
+        self.assertOvertime(result, -660 / H, -660 / H)
+
+    def test_compute_overtime(self):
+        days = [
+            (DAY_PLANNED, [(8 * H, 19 * H, 10.0)], DAY_LUNCHES),
+            ([], [(8 * H, 12 * H, 4.0)], []),
+        ]
+        self.assertEqual(compute_overtime(days, 1.0, 0), [
+            compute_day_overtime(DAY_PLANNED, [(8 * H, 19 * H, 10.0)], DAY_LUNCHES, 1.0, 0),
+            compute_day_overtime([], [(8 * H, 12 * H, 4.0)], [], 1.0, 0),
+        ])
+
+    def test_planned_shift_end(self):
+        intervals = NIGHT_PLANNED + [(46 * H, 54 * H)]
+        # The break at 02:00 is within the shift, the next day is another shift
+        self.assertEqual(planned_shift_end(21.5 * H, intervals), 30 * H)
+        self.assertEqual(planned_shift_end(26.5 * H, intervals), 30 * H)
+        self.assertEqual(planned_shift_end(30 * H, intervals), 54 * H)
+        # A break longer than max_gap ends the shift
+        self.assertEqual(planned_shift_end(21.5 * H, intervals, max_gap=H / 2), 26 * H)
+        self.assertIsNone(planned_shift_end(54 * H, intervals))
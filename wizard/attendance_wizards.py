@@ -0,0 +1,48 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, exceptions, fields, models, _
+
+
+class HrAttendancePayrollExport(models.TransientModel):
+    _name = 'hr.attendance.payroll.export'
+    _description = 'Export attendances and overtime for the payroll'
+
+    def _default_date_from(self):
+        return fields.Date.context_today(self) + relativedelta(months=-1, day=1)
+
+    def _default_date_to(self):
+        return fields.Date.context_today(self) + relativedelta(day=1, days=-1)
+
+    date_from = fields.Date('From', required=True, default=_default_date_from)
+    date_to = fields.Date('To', required=True, default=_default_date_to)
+    company_ids = fields.Many2many('res.company', string='Companies', required=True,
+                                   default=lambda self: self.env.companies,
+                                   domain=lambda self: [('id', 'in', self.env.companies.ids)])
+    department_ids = fields.Many2many('hr.department', string='Departments',
+                                      help="Leave empty to export every department. Sub-departments are included.")
+    file_format = fields.Selection([
+        ('csv', 'CSV'),
+        ('xlsx', 'XLSX'),
+    ], string='Format', required=True, default='xlsx')
+
+    @api.constrains('date_from', 'date_to')
+    def _check_dates(self):
+        for export in self:
+            if export.date_from > export.date_to:
+                raise exceptions.ValidationError(_("The start date of the export must be earlier than its end date."))
+
+    def _get_department_ids(self):
+        self.ensure_one()
+        if not self.department_ids:
+            return []
+        return self.env['hr.department'].search([('id', 'child_of', self.department_ids.ids)]).ids
+
+    def action_export(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'target': 'self',
+            'url': '/company_connect/payroll_export/%s' % self.id,
+        }
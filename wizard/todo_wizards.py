@@ -8,24 +8,18 @@ class MailActivityTodoCreate(models.TransientModel):
 
     summary = fields.Char()
     date_deadline = fields.Date('Due Date', index=True, required=True, default=fields.Date.context_today)
-    user_id = fields.Many2one('res.users', 'Assigned to', default=lambda self: self.env.user, required=True, readonly=True)
+    user_ids = fields.Many2many('res.users', string='Assigned to', default=lambda self: self.env.user, required=True,
+                                domain="[('share', '=', False)]")
     note = fields.Html(sanitize_style=True)
 
     def create_todo_activity(self):
-        todo = self.env['project.task'].create({
-            'name': self.summary,
-            'description': self.note,
-            'date_deadline': self.date_deadline,
-            'user_ids': self.user_id.ids,
-        })
-        self.env['mail.activity'].create({
-            'res_model_id': self.env['ir.model']._get('project.task').id,
-            'res_id': todo.id,
+        # One private to-do per assignee
+        self.env['project.task']._create_todo_activities([{
             'summary': self.summary,
-            'user_id': self.user_id.id,
+            'note': self.note,
             'date_deadline': self.date_deadline,
-            'activity_type_id': self.env['mail.activity']._default_activity_type_for_model('project.task').id,
-        })
+            'user_id': user.id,
+        } for user in self.user_ids])
 
         return {
             'type': 'ir.actions.client',